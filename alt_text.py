@@ -0,0 +1,243 @@
+# alt text generators main.py can use
+#   tailwind - uploads the image to tailwindapp.com's generator in the browser (needs a page)
+#   local    - captions downscaled thumbnails with a CPU model on a process pool,
+#              needs `pip install transformers torch`, model picked with ALT_TEXT_MODEL in .env
+# results are cached in state.db by image hash, so the same image is never described twice
+
+import importlib.util
+import multiprocessing
+import os
+import queue
+import threading
+
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from chunked_upload import file_md5
+from downscale import MAX_BYTES
+from ratelimit import get_limiter
+from state import StateStore
+
+
+load_dotenv()
+
+TAILWIND_URL = os.getenv('TAILWIND_URL', 'https://www.tailwindapp.com/marketing/tools/image-alt-text-generator')
+LOCAL_MODEL = os.getenv('ALT_TEXT_MODEL', 'Salesforce/blip-image-captioning-base')
+
+# the captioning model works at this resolution, anything larger is wasted decoding
+THUMBNAIL_SIZE = 384
+
+
+class AltTextBackend:
+    name = ''
+    # True when generate() drives a browser page
+    needs_page = False
+    # largest file the backend accepts, None for no limit
+    max_bytes = None
+
+    def generate(self, path, page=None) -> str:
+        raise NotImplementedError
+
+    def submit(self, path) -> Future:
+        # backends that don't need a page can work ahead of the pipeline
+        future = Future()
+        try:
+            future.set_result(self.generate(path))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        pass
+
+
+class TailwindBackend(AltTextBackend):
+    name = 'tailwind'
+    needs_page = True
+    max_bytes = MAX_BYTES
+
+    def generate(self, path, page=None) -> str:
+        # a generator that stops answering times out below, which the limiter counts against tailwind
+        with get_limiter('tailwind').slot() as slot:
+            response = page.goto(TAILWIND_URL, wait_until='domcontentloaded')
+            if response is not None:
+                slot.status(response.status, response.headers.get('retry-after'))
+
+            page.wait_for_selector('input[type="file"]', timeout=10_000)
+            page.locator('input[type="file"]').set_input_files(str(path))
+
+            alt_text_locator = page.locator('textarea')
+            alt_text_locator.wait_for(timeout=10_000)
+
+            return alt_text_locator.input_value().strip()
+
+
+# per process model, loaded once by the pool initializer
+_model = None
+
+
+def _load_model(model_name, threads):
+    global _model
+
+    import torch
+    from transformers import BlipForConditionalGeneration, BlipProcessor
+
+    torch.set_num_threads(threads)
+    processor = BlipProcessor.from_pretrained(model_name)
+    model = BlipForConditionalGeneration.from_pretrained(model_name).to('cpu').eval()
+    _model = (processor, model)
+
+
+def _thumbnail(path):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        # lets the JPEG decoder skip most of the pixels of a big original
+        image.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        image = image.convert('RGB')
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        return image
+
+
+def _caption_batch(paths) -> list[str]:
+    import torch
+
+    processor, model = _model
+    images = [_thumbnail(path) for path in paths]
+    inputs = processor(images=images, return_tensors='pt')
+    with torch.inference_mode():
+        output = model.generate(**inputs, max_new_tokens=60)
+
+    captions = processor.batch_decode(output, skip_special_tokens=True)
+    return [caption.strip().capitalize() + ('' if caption.strip().endswith('.') else '.') for caption in captions]
+
+
+class LocalCaptionBackend(AltTextBackend):
+    name = 'local'
+
+    def __init__(self, workers=None, batch_size=8, max_wait=0.5, model=LOCAL_MODEL):
+        for module in ('torch', 'transformers', 'PIL'):
+            if importlib.util.find_spec(module) is None:
+                raise RuntimeError('The local alt text backend needs: pip install transformers torch pillow')
+
+        workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_load_model,
+            initargs=(model, threads),
+        )
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+        # single images queue up here and go to the pool in batches
+        self.pending = queue.Queue()
+        self.batcher = threading.Thread(target=self._batch_loop, daemon=True)
+        self.batcher.start()
+
+    def _batch_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            # batch_size 1 sends each image straight away, without waiting max_wait for company
+            batch = [item]
+            try:
+                while len(batch) < self.batch_size:
+                    item = self.pending.get(timeout=self.max_wait)
+                    if item is None:
+                        self.pending.put(None)
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        def done(result: Future):
+            try:
+                captions = result.result()
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            for (_, future), caption in zip(batch, captions):
+                future.set_result(caption)
+
+        try:
+            self.pool.submit(_caption_batch, [path for path, _ in batch]).add_done_callback(done)
+        except Exception as e:
+            # broken pool, fail the batch rather than leave its callers waiting
+            for _, future in batch:
+                future.set_exception(e)
+
+    def submit(self, path) -> Future:
+        future = Future()
+        self.pending.put((str(path), future))
+        return future
+
+    def generate(self, path, page=None) -> str:
+        return self.submit(path).result()
+
+    def close(self):
+        self.pending.put(None)
+        self.batcher.join()
+        self.pool.shutdown(wait=True)
+
+
+class CachedBackend(AltTextBackend):
+    # looks up state.db by image md5 before asking the real backend
+    def __init__(self, backend: AltTextBackend, state: StateStore):
+        self.backend = backend
+        self.state = state
+        self.name = backend.name
+        self.needs_page = backend.needs_page
+        self.max_bytes = backend.max_bytes
+
+    def generate(self, path, page=None, md5=None, original=None) -> str:
+        # path is what the backend reads, original (default path) is what the cache is keyed by
+        md5 = md5 or file_md5(original or path)
+        cached = self.state.cached_alt_text(md5, self.name)
+        if cached is not None:
+            return cached
+
+        alt_text = self.backend.generate(path, page)
+        self.state.store_alt_text(md5, self.name, alt_text)
+        return alt_text
+
+    def submit(self, path, md5=None) -> Future | None:
+        # None when the backend needs a browser page and nothing is cached yet
+        md5 = md5 or file_md5(path)
+        cached = self.state.cached_alt_text(md5, self.name)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        if self.needs_page:
+            return None
+
+        def store(result: Future):
+            if result.exception() is None:
+                self.state.store_alt_text(md5, self.name, result.result())
+
+        future = self.backend.submit(path)
+        future.add_done_callback(store)
+        return future
+
+    def close(self):
+        self.backend.close()
+
+
+BACKENDS = {
+    'tailwind': TailwindBackend,
+    'local': LocalCaptionBackend,
+}
+
+
+def make_backend(name, state: StateStore, **kwargs) -> CachedBackend:
+    return CachedBackend(BACKENDS[name](**kwargs), state)
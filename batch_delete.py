@@ -1,52 +1,149 @@
-import requests
-import os
-from dotenv import load_dotenv
+# deletes Piwigo images in chunks, several chunks at a time
+# IDs come from a file (one per line, - for stdin), an album, a tag, a main.py run, or typed in one by one
+# deleted IDs are flagged in state.db, so running the same command again only sends what is left
 
+import argparse
+import sys
 
-image_ids = []
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-run = False
-while not run:
-    image_id = str(input("Piwigo ID to delete (type run to run, exit to exit): ")).strip()
-    if image_id == 'run':
-        run = True
-        break
+from piwigo_api import PiwigoClient, PiwigoError, get_client
+from state import open_state
 
-    if image_id == 'exit':
-        quit()
 
-    image_ids.append(image_id)
+CHUNK = 100
 
-print("Images to delete:")
-for image_id in image_ids:
-    print({image_id}, end=', ')
 
-print(end='\n')
+def read_ids(lines) -> list[str]:
+    # one ID per line, tabs/commas/semicolons also split, header rows and blanks are ignored
+    ids = []
+    for line in lines:
+        for part in line.replace('\t', ',').replace(';', ',').split(','):
+            part = part.strip()
+            if part.isdigit():
+                ids.append(part)
+    return ids
 
-if image_ids:
-    load_dotenv()
-    API_KEY = os.getenv("API_KEY")
 
-    HEADERS = {"X-PIWIGO-API": API_KEY}
-    PIWIGO_URL = "https://mines.piwigo.com/ws.php?format=json"
+def prompt_ids() -> list[str]:
+    image_ids = []
+    while True:
+        image_id = str(input('Piwigo ID to delete (type run to run, exit to exit): ')).strip()
+        if image_id == 'run':
+            return image_ids
 
-    session = requests.Session()
-    session.headers.update(HEADERS)
+        if image_id == 'exit':
+            quit()
 
-    # 1. get pwg_token
-    r = session.post(PIWIGO_URL, data={"method": "pwg.session.getStatus"}, timeout=30)
-    js = r.json()
+        image_ids.append(image_id)
 
-    if js.get("stat") != "ok":
-        raise RuntimeError(js)
 
-    pwg_token = js["result"]["pwg_token"]
+def listed_ids(client: PiwigoClient, method, params, per_page=500) -> list[str]:
+    # every page of pwg.categories.getImages / pwg.tags.getImages
+    ids = []
+    page = 0
+    while True:
+        result = client.post(method, {**params, 'per_page': per_page, 'page': page}) or {}
+        images = result.get('images', [])
+        ids.extend(str(image['id']) for image in images)
 
-    payload = {
-        "method": "pwg.images.delete",
-        "image_id": ";".join(map(str, image_ids)),
-        "pwg_token": pwg_token,
-    }
+        if len(images) < per_page:
+            return ids
+        page += 1
 
-    r = session.post(PIWIGO_URL, data=payload, timeout=30)
-    print(r.json())
+
+def delete_chunk(client: PiwigoClient, image_ids):
+    return client.post('pwg.images.delete', {
+        'image_id': ';'.join(image_ids),
+        'pwg_token': client.pwg_token(),
+    }, retry_timeouts=False)
+
+
+def delete(client: PiwigoClient, state, image_ids, chunk=CHUNK, workers=4) -> list[str]:
+    # returns the ids that were deleted
+    chunks = [image_ids[i:i + chunk] for i in range(0, len(image_ids), chunk)]
+    deleted = []
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(delete_chunk, client, ids): n for n, ids in enumerate(chunks, 1)}
+        for future in as_completed(futures):
+            n = futures[future]
+            ids = chunks[n - 1]
+            try:
+                result = future.result()
+            except PiwigoError as e:
+                print(f'Chunk {n}/{len(chunks)} ({ids[0]}..{ids[-1]}): FAILED {e}')
+                continue
+
+            # flag right away, a later failing chunk shouldn't make this one run again
+            state.mark_deleted(ids)
+            deleted.extend(ids)
+            print(f'Chunk {n}/{len(chunks)} ({ids[0]}..{ids[-1]}): deleted {len(ids)} ({result})')
+
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete images from Piwigo in chunks')
+    parser.add_argument('file', nargs='?', help='file with one Piwigo ID per line, - for stdin (asks if nothing is given)')
+    parser.add_argument('--category', type=int, action='append', default=[], help='delete every image in this album')
+    parser.add_argument('--tag', action='append', default=[], help='delete every image with this tag (name or id)')
+    parser.add_argument('--run', action='append', default=[], help='delete everything main.py uploaded in this Run ID')
+    parser.add_argument('--chunk', type=int, default=CHUNK, help='images per pwg.images.delete request')
+    parser.add_argument('--workers', type=int, default=4, help='requests in parallel')
+    parser.add_argument('--force', action='store_true', help='also send IDs state.db already has as deleted')
+    parser.add_argument('--dry-run', action='store_true', help='list what would be deleted and stop')
+    parser.add_argument('-y', '--yes', action='store_true', help="don't ask for confirmation")
+    args = parser.parse_args()
+
+    client = get_client()
+    state = open_state()
+
+    image_ids = []
+    if args.file == '-':
+        image_ids += read_ids(sys.stdin)
+    elif args.file:
+        with open(args.file, encoding='utf-8') as f:
+            image_ids += read_ids(f)
+    for category_id in args.category:
+        image_ids += listed_ids(client, 'pwg.categories.getImages', {'cat_id': category_id})
+    for tag in args.tag:
+        image_ids += listed_ids(client, 'pwg.tags.getImages', {'tag_id' if tag.isdigit() else 'tag_name': tag})
+    for run_id in args.run:
+        image_ids += state.run_piwigo_ids(run_id)
+
+    if not (args.file or args.category or args.tag or args.run):
+        image_ids = prompt_ids()
+
+    # keep the first occurrence of each id
+    image_ids = list(dict.fromkeys(image_ids))
+    if not args.force:
+        already = state.deleted_ids()
+        skipped = [image_id for image_id in image_ids if image_id in already]
+        image_ids = [image_id for image_id in image_ids if image_id not in already]
+        if skipped:
+            print(f'{len(skipped)} already deleted, skipping (--force to send them anyway)')
+
+    if not image_ids:
+        print('Nothing to delete')
+        return
+
+    print(f'{len(image_ids)} images to delete: {", ".join(image_ids[:20])}{" ..." if len(image_ids) > 20 else ""}')
+    if args.dry_run:
+        return
+
+    if not args.yes:
+        if args.file == '-':
+            print('Reading IDs from stdin, add --yes to confirm')
+            return
+        if input('Delete them? [y/N] ').strip().lower() != 'y':
+            return
+
+    deleted = delete(client, state, image_ids, args.chunk, args.workers)
+    print(f'Deleted {len(deleted)} of {len(image_ids)}')
+    if len(deleted) < len(image_ids):
+        print('Run the same command again to retry the rest')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+# offline throughput check, runs the tools against mock_server.py in a scratch folder
+#   python benchmark.py --images 50 --latency 0.05 --error-rate 0.02 --output bench.json
+#   python benchmark.py --compare bench.json   (after a change, prints how much faster or slower each scenario got)
+# reports images/sec, p50/p95 latency per stage and per Piwigo method, and peak memory, as JSON
+# main.py needs Playwright's Chromium, without it that scenario is reported as failed and the others run on seeded images
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from collections import defaultdict
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # Windows has no resource module, the process peak is left out there
+    resource = None
+
+from mock_server import MockPiwigo, env_for, serve
+
+
+SCENARIOS = ('main', 'audit', 'copyright', 'delete')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Timings:
+    # durations in seconds by name, for the scenario that is running
+    def __init__(self):
+        self.current = defaultdict(list)
+
+    def reset(self):
+        self.current = defaultdict(list)
+
+    def wrap(self, owner, attribute, name):
+        original = getattr(owner, attribute)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.current[name(*args) if callable(name) else name].append(time.perf_counter() - start)
+
+        setattr(owner, attribute, timed)
+
+    def summary(self) -> dict:
+        return {
+            name: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+            }
+            for name, values in sorted(self.current.items())
+        }
+
+
+def make_images(folder: Path, count, start_id=100_000_000):
+    # small distinct JPEGs, so the duplicate check doesn't skip any of them
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(0)
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+
+    for n in range(count):
+        path = folder / f'Depositphotos_{start_id + n}_XL.jpg'
+        if Image is not None:
+            Image.new('RGB', (64, 48), tuple(rng.randrange(256) for _ in range(3))).save(path, quality=90)
+            with open(path, 'ab') as f:
+                f.write(n.to_bytes(4, 'big'))
+        else:
+            path.write_bytes(b'\xff\xd8\xff\xe0' + rng.randbytes(2048) + n.to_bytes(4, 'big') + b'\xff\xd9')
+
+
+def seed_gallery(gallery: MockPiwigo, state, folder: Path, run_id):
+    # stands in for a main.py run that couldn't happen, so the other scenarios have images to work on
+    from description import build_description
+    from scanner import scan
+
+    for path, deposit_id in scan(folder):
+        alt_text = f'A benchmark photo named {path.name}.'
+        url = f'https://depositphotos.com/{deposit_id}/stock-photo.html'
+        image_id = gallery.add_image(
+            f'Benchmark photo {deposit_id}', build_description(alt_text, url, 'Bench Author'), 'Bench Author',
+        )
+        state.complete(deposit_id, path, url, f'Benchmark photo {deposit_id}', 'Bench Author', alt_text,
+                       [f'keyword {n}' for n in range(15)], image_id, run_id)
+
+
+def run_scenario(timings: Timings, target, count, verbose=False) -> dict:
+    timings.reset()
+    tracemalloc.start()
+    output = io.StringIO()
+    error = None
+
+    start = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(output))
+                stack.enter_context(contextlib.redirect_stderr(output))
+            target()
+    except (Exception, SystemExit) as e:
+        error = f'{type(e).__name__}: {str(e).strip().splitlines()[0] if str(e).strip() else ""}'
+    elapsed = time.perf_counter() - start
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    images = count()
+    return {
+        'images': images,
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(images / elapsed, 3) if elapsed else None,
+        'peak_python_mb': round(peak / 1e6, 2),
+        'latency': timings.summary(),
+        'error': error,
+    }
+
+
+def run(args) -> dict:
+    gallery = MockPiwigo(args.latency, args.error_rate, args.alt_text_delay, seed=args.seed)
+    server = serve(gallery)
+
+    # every module reads these when it is first imported, so they go in before any import below
+    os.environ.update(env_for(server))
+    os.environ.update({'API_KEY': 'benchmark', 'USERNAME': 'bench', 'PASSWORD': 'bench'})
+
+    workdir = Path(tempfile.mkdtemp(prefix='piwigo-bench-'))
+    os.chdir(workdir)
+    folder = workdir / 'images'
+    make_images(folder, args.images)
+
+    import batch_delete
+    import description_audit
+    import main
+    import set_copyright
+    from piwigo_api import PiwigoClient
+    from state import open_state
+
+    state = open_state()
+    timings = Timings()
+    timings.wrap(PiwigoClient, 'post', lambda client, method, *rest: 'ws ' + method)
+    timings.wrap(set_copyright, 'set_copyright', 'admin batch_manager')
+    for stage, function in (('alt_text', 'generate_alt_text'), ('deposit', 'scrape_deposit'), ('upload', 'upload')):
+        timings.wrap(main, function, 'stage ' + stage)
+
+    results = {}
+
+    if 'main' in args.scenarios:
+        options = main.Options(workers=args.workers, uploaders=args.uploaders, scraper=args.scraper, headless=True)
+        results['main'] = run_scenario(
+            timings, lambda: main.main(folder, options), lambda: len(state.piwigo_ids()), args.verbose,
+        )
+
+    run_ids = {row[0] for row in state.conn.execute('SELECT DISTINCT run_id FROM images WHERE run_id IS NOT NULL')}
+    if not state.piwigo_ids():
+        seed_gallery(gallery, state, folder, 'benchmark-seed')
+        run_ids = {'benchmark-seed'}
+
+    total = len(state.piwigo_ids())
+
+    if 'audit' in args.scenarios:
+        results['audit'] = run_scenario(
+            timings, lambda: description_audit.main(args.concurrency), lambda: total, args.verbose,
+        )
+
+    if 'copyright' in args.scenarios:
+        results['copyright'] = run_scenario(
+            timings, lambda: set_copyright.main(workers=args.concurrency),
+            lambda: total - len(state.uncopyrighted_ids()), args.verbose,
+        )
+
+    if 'delete' in args.scenarios:
+        def delete():
+            argv = ['batch_delete.py', '-y', '--workers', str(args.concurrency)]
+            for run_id in run_ids:
+                argv += ['--run', run_id]
+            sys.argv = argv
+            batch_delete.main()
+
+        results['delete'] = run_scenario(
+            timings, delete, lambda: len(state.deleted_ids()), args.verbose,
+        )
+
+    server.shutdown()
+
+    report = {
+        'config': {
+            'images': args.images,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'alt_text_delay': args.alt_text_delay,
+            'workers': args.workers,
+            'uploaders': args.uploaders,
+            'concurrency': args.concurrency,
+            'scraper': args.scraper,
+        },
+        'scenarios': results,
+        'server_requests': dict(sorted(gallery.requests.items())),
+    }
+    if resource is not None:
+        # KB on Linux, bytes on macOS
+        scale = 1e6 if sys.platform == 'darwin' else 1e3
+        report['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    return report
+
+
+def compare(old: dict, new: dict) -> list[str]:
+    lines = []
+    for name, result in new['scenarios'].items():
+        before = old.get('scenarios', {}).get(name)
+        if not before or not before.get('images_per_sec') or not result.get('images_per_sec'):
+            continue
+        change = result['images_per_sec'] / before['images_per_sec'] - 1
+        lines.append(f'{name}: {before["images_per_sec"]} -> {result["images_per_sec"]} images/sec ({change:+.0%})')
+        for stage, timing in result['latency'].items():
+            was = before.get('latency', {}).get(stage)
+            if was and was['p95_ms']:
+                lines.append(f'  {stage} p95: {was["p95_ms"]} -> {timing["p95_ms"]} ms')
+    return lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the transfer tools against a local mock Piwigo')
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help='average seconds added to every mock request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of mock requests answered with a 503')
+    parser.add_argument('--alt-text-delay', type=float, default=0.2, help='seconds the fake alt text generator takes')
+    parser.add_argument('--scenario', choices=SCENARIOS, action='append', dest='scenarios',
+                        help='only run this scenario, repeatable (default all)')
+    parser.add_argument('--workers', type=int, default=1, help='main.py --workers')
+    parser.add_argument('--uploaders', type=int, default=2, help='main.py --uploaders')
+    parser.add_argument('--scraper', choices=['browser', 'http'], default='http', help='main.py --scraper')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel requests for the other tools')
+    parser.add_argument('--seed', type=int, default=0, help='seed for injected latency and errors')
+    parser.add_argument('--output', help='write the JSON report here as well')
+    parser.add_argument('--compare', help='earlier JSON report to compare against')
+    parser.add_argument('--verbose', action='store_true', help="show the tools' own output")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    # paths given on the command line are relative to where it was run, the benchmark itself runs in a scratch folder
+    output = Path(args.output).resolve() if args.output else None
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        output.write_text(text + '\n')
+    if baseline:
+        print('\n'.join(compare(baseline, report)))
@@ -0,0 +1,438 @@
+# playwright helpers shared by the browser based scripts
+# launch/open_context set up a browser that behaves the same headless, hidden or minimized,
+# and contexts start from storage_state.json so cookies and logins carry over between runs and workers
+# block_requests aborts resources we never read (images, fonts, ads, analytics) and counts what each site costs
+# the blocklist can be tuned in .env with BLOCK_RESOURCE_TYPES, BLOCK_DOMAINS and ALLOW_DOMAINS (comma separated)
+# BrowserSupervisor gives a worker a page that is swapped for a fresh one every so many images, when chromium
+# grows past a memory ceiling, or when the page crashes or hangs, and the item it was working on runs again
+
+import os
+import sys
+import threading
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import urlsplit
+
+try:
+    import psutil
+except ImportError:
+    # browser memory isn't measured, contexts are still recycled every so many images
+    psutil = None
+
+from dotenv import load_dotenv
+from playwright.sync_api import Browser, BrowserContext, Page, Playwright, Request, Response, Route
+
+from deposit_scrape import HEADERS
+from piwigo_api import STORAGE_STATE, write_storage_state
+
+
+load_dotenv()
+
+# chrome slows timers and skips rendering for hidden or minimized windows, which stalls the lazy loaded sections
+LAUNCH_ARGS = [
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+]
+
+# a desktop sized window, so layouts and lazy loading match what a person sees
+VIEWPORT = {'width': 1920, 'height': 1080}
+
+# headless chrome puts "HeadlessChrome" in its user agent, a regular one gets the regular page
+USER_AGENT = HEADERS['User-Agent']
+
+# pages that hold work back until they are visible see a visible tab
+VISIBLE_SCRIPT = '''
+Object.defineProperty(document, 'visibilityState', {get: () => 'visible'});
+Object.defineProperty(document, 'hidden', {get: () => false});
+'''
+
+# we only ever read text nodes, stylesheets stay because visibility checks depend on them
+BLOCKED_TYPES = {'image', 'media', 'font'}
+
+BLOCKED_DOMAINS = {
+    'google-analytics.com',
+    'googletagmanager.com',
+    'googleadservices.com',
+    'googlesyndication.com',
+    'doubleclick.net',
+    'adservice.google.com',
+    'facebook.net',
+    'connect.facebook.com',
+    'hotjar.com',
+    'clarity.ms',
+    'bat.bing.com',
+    'criteo.com',
+    'criteo.net',
+    'taboola.com',
+    'outbrain.com',
+    'segment.io',
+    'segment.com',
+    'amplitude.com',
+    'mixpanel.com',
+    'intercom.io',
+    'hs-analytics.net',
+    'hs-scripts.com',
+    'nr-data.net',
+    'sentry.io',
+    'tiktok.com',
+    'pinterest.com',
+    'snap.licdn.com',
+}
+
+
+def _env_set(name) -> set[str] | None:
+    value = os.getenv(name)
+    if value is None:
+        return None
+    return {item.strip().lower() for item in value.split(',') if item.strip()}
+
+
+def _matches(host, domains):
+    return any(host == d or host.endswith('.' + d) for d in domains)
+
+
+@dataclass
+class BlockConfig:
+    types: set[str] = field(default_factory=lambda: set(BLOCKED_TYPES))
+    domains: set[str] = field(default_factory=lambda: set(BLOCKED_DOMAINS))
+    # never blocked, even if a type or domain rule matches
+    allow: set[str] = field(default_factory=set)
+    enabled: bool = True
+
+    @classmethod
+    def from_env(cls, enabled=True):
+        config = cls(enabled=enabled)
+        types = _env_set('BLOCK_RESOURCE_TYPES')
+        if types is not None:
+            config.types = types
+        config.domains |= _env_set('BLOCK_DOMAINS') or set()
+        config.allow = _env_set('ALLOW_DOMAINS') or set()
+        return config
+
+    def blocks(self, request: Request) -> str | None:
+        # reason the request should be aborted, None to let it through
+        if not self.enabled:
+            return None
+
+        host = (urlsplit(request.url).hostname or '').lower()
+        if _matches(host, self.allow):
+            return None
+        if request.resource_type in self.types:
+            return request.resource_type
+        if _matches(host, self.domains):
+            return host
+        return None
+
+
+@dataclass
+class SiteTraffic:
+    loads: int = 0
+    requests: int = 0
+    blocked: int = 0
+    bytes: int = 0
+
+
+class TrafficStats:
+    # requests, blocked requests and response bytes per site, shared by every page of a run
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = {}
+        self.blocked_by = {}
+
+    def _site(self, page_url) -> SiteTraffic:
+        host = urlsplit(page_url or '').hostname or 'other'
+        return self.sites.setdefault(host, SiteTraffic())
+
+    def loaded(self, page_url):
+        with self.lock:
+            self._site(page_url).loads += 1
+
+    def request(self, page_url, blocked_reason=None):
+        with self.lock:
+            site = self._site(page_url)
+            site.requests += 1
+            if blocked_reason:
+                site.blocked += 1
+                self.blocked_by[blocked_reason] = self.blocked_by.get(blocked_reason, 0) + 1
+
+    def response(self, page_url, size):
+        with self.lock:
+            self._site(page_url).bytes += size
+
+    def report(self) -> str:
+        with self.lock:
+            lines = ['Browser traffic per page load:']
+            for host, site in sorted(self.sites.items()):
+                loads = max(site.loads, 1)
+                lines.append(
+                    f'  {host}: {site.loads} loads, {site.requests / loads:.1f} requests '
+                    f'({site.blocked / loads:.1f} blocked), {site.bytes / loads / 1024:.0f} KB'
+                )
+            if self.blocked_by:
+                top = sorted(self.blocked_by.items(), key=lambda item: -item[1])[:10]
+                lines.append('  most blocked: ' + ', '.join(f'{reason} {count}' for reason, count in top))
+            return '\n'.join(lines)
+
+
+def _page_url(request: Request):
+    try:
+        return request.frame.page.url
+    except Exception:
+        # service workers and requests from closed pages have no page
+        return request.url
+
+
+def block_requests(context: BrowserContext, config: BlockConfig = None, stats: TrafficStats = None) -> TrafficStats:
+    # install on a context before opening pages, every page in it is covered
+    config = config or BlockConfig.from_env()
+    stats = stats if stats is not None else TrafficStats()
+
+    def handle(route: Route, request: Request):
+        reason = config.blocks(request)
+        stats.request(_page_url(request), reason)
+        if reason:
+            route.abort('blockedbyclient')
+        else:
+            route.continue_()
+
+    def on_response(response: Response):
+        # content-length is already in the headers, reading the body would cost another round trip
+        size = response.headers.get('content-length')
+        if size and size.isdigit():
+            stats.response(_page_url(response.request), int(size))
+
+    def on_page(page: Page):
+        page.on('framenavigated', lambda frame: frame == page.main_frame and stats.loaded(frame.url))
+
+    context.route('**/*', handle)
+    context.on('response', on_response)
+    context.on('page', on_page)
+    for page in context.pages:
+        on_page(page)
+
+    return stats
+
+
+def display_available() -> bool:
+    if sys.platform.startswith('linux'):
+        return bool(os.getenv('DISPLAY') or os.getenv('WAYLAND_DISPLAY'))
+    return True
+
+
+def launch(playwright: Playwright, headless=None) -> Browser:
+    # headless=None shows the window when there is a screen to show it on
+    if headless is None:
+        headless = not display_available()
+    return playwright.chromium.launch(headless=headless, args=LAUNCH_ARGS)
+
+
+def open_context(browser: Browser, storage_state=STORAGE_STATE, **kwargs) -> BrowserContext:
+    saved = str(storage_state) if storage_state and Path(storage_state).exists() else None
+    options = {'viewport': VIEWPORT, 'user_agent': USER_AGENT, **kwargs}
+    try:
+        context = browser.new_context(storage_state=saved, **options)
+    except Exception:
+        if saved is None:
+            raise
+        # a broken or outdated file shouldn't stop the run, it gets replaced at the end
+        context = browser.new_context(**options)
+    context.add_init_script(VISIBLE_SCRIPT)
+    return context
+
+
+def save_storage_state(context: BrowserContext, path=STORAGE_STATE):
+    # every worker saves when it finishes, cookies the context doesn't have (the API session's) are kept
+    state = context.storage_state()
+    write_storage_state(state['cookies'], state.get('origins', []), path)
+
+
+class BrowserMemory:
+    # chromium memory samples from every worker of a run
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.total = 0.0
+        self.peak = 0.0
+        self.recycles = 0
+        self.restarts = 0
+        self.memory_restarts = 0
+
+    def sample(self, mb):
+        with self.lock:
+            self.samples += 1
+            self.total += mb
+            self.peak = max(self.peak, mb)
+
+    def count(self, kind='recycle'):
+        # recycle, restart after a crash or hang, or memory for a restart over the ceiling
+        with self.lock:
+            if kind == 'restart':
+                self.restarts += 1
+            elif kind == 'memory':
+                self.memory_restarts += 1
+            else:
+                self.recycles += 1
+
+    def report(self) -> str:
+        with self.lock:
+            if self.samples:
+                line = f'Browser memory per worker: peak {self.peak:.0f} MB, average {self.total / self.samples:.0f} MB'
+            elif psutil is None:
+                line = 'Browser memory not measured (pip install psutil)'
+            else:
+                line = 'Browser memory not measured'
+            return line + (
+                f', {self.recycles} recycled contexts, {self.memory_restarts} restarts over the memory ceiling, '
+                f'{self.restarts} restarts after a crash or hang'
+            )
+
+
+# pids of browsers being started, so each supervisor can tell its own chromium apart from the other workers'
+_launch_lock = threading.Lock()
+
+
+def _descendants() -> set[int]:
+    return {p.pid for p in psutil.Process().children(recursive=True)}
+
+
+class BrowserSupervisor:
+    # one browser, context and page for one thread, playwright's sync api can't share them
+    def __init__(self, playwright: Playwright, headless=None, new_context=open_context, on_page=None,
+                 recycle_every=200, max_mb=1500, memory: BrowserMemory = None, log=print):
+        self.playwright = playwright
+        self.headless = headless
+        self.new_context = new_context
+        # runs on every new page, e.g. to log in again
+        self.on_page = on_page
+        self.recycle_every = recycle_every
+        self.max_mb = max_mb
+        self.memory = memory if memory is not None else BrowserMemory()
+        self.log = log
+
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.roots = []
+        self.crashed = False
+        self.items = 0
+        self._start_browser()
+
+    def _start_browser(self):
+        if psutil is None:
+            self.browser = launch(self.playwright, self.headless)
+        else:
+            with _launch_lock:
+                before = _descendants()
+                self.browser = launch(self.playwright, self.headless)
+                new = _descendants() - before
+            # the main chromium process, its renderers are started later as its children
+            self.roots = []
+            for pid in new:
+                try:
+                    process = psutil.Process(pid)
+                    if process.ppid() not in new and 'node' not in process.name().lower():
+                        self.roots.append(process)
+                except psutil.Error:
+                    pass
+        self._start_context()
+
+    def _start_context(self):
+        self.context = self.new_context(self.browser)
+        self._start_page()
+
+    def _start_page(self):
+        self.crashed = False
+        self.page = self.context.new_page()
+        self.page.on('crash', self._on_crash)
+        if self.on_page is not None:
+            self.on_page(self.page)
+
+    def _on_crash(self, page):
+        self.crashed = True
+
+    def rss_mb(self) -> float | None:
+        if not self.roots:
+            return None
+        total = 0
+        for root in self.roots:
+            try:
+                processes = [root] + root.children(recursive=True)
+            except psutil.Error:
+                continue
+            for process in processes:
+                try:
+                    total += process.memory_info().rss
+                except psutil.Error:
+                    pass
+        return total / 1e6
+
+    def _close_context(self, save=True):
+        if save:
+            try:
+                save_storage_state(self.context)
+            except Exception:
+                # a crashed context can't always report its cookies, the file keeps the last good ones
+                pass
+        try:
+            self.context.close()
+        except Exception:
+            pass
+
+    def recycle(self):
+        # a fresh context drops whatever the pages piled up, the saved cookies carry over
+        self._close_context()
+        self._start_context()
+        self.memory.count()
+
+    def restart(self, reason, kind='restart'):
+        self.log(f'Browser {reason}, starting a new one')
+        self._close_context()
+        try:
+            self.browser.close()
+        except Exception:
+            pass
+        self._start_browser()
+        self.memory.count(kind)
+
+    def healthy(self, timeout=5_000) -> bool:
+        if self.crashed or self.page.is_closed() or not self.browser.is_connected():
+            return False
+        try:
+            # a renderer that can't run this much is hung
+            self.page.wait_for_function('true', timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    def run(self, work):
+        # work(page) once, and once more on a new browser if the page crashed or hung on the way
+        try:
+            return work(self.page)
+        except Exception:
+            if self.healthy():
+                raise
+            reason = 'page crashed' if self.crashed else 'stopped responding'
+        self.restart(reason)
+        return work(self.page)
+
+    def item_done(self):
+        # between items, so nothing is in flight on the page
+        self.items += 1
+        mb = self.rss_mb()
+        if mb is not None:
+            self.memory.sample(mb)
+
+        if self.max_mb and mb is not None and mb > self.max_mb:
+            # the browser process itself grows too, only a new one gives that back
+            self.restart(f'is using {mb:.0f} MB', kind='memory')
+        elif self.recycle_every and self.items % self.recycle_every == 0:
+            self.recycle()
+
+    def close(self):
+        self._close_context()
+        try:
+            self.browser.close()
+        except Exception:
+            pass
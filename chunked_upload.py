@@ -0,0 +1,89 @@
+# upload through pwg.images.addChunk + pwg.images.add instead of one big addSimple request
+# chunks are read straight from disk, sent in parallel and remembered in state.db,
+# so a failed upload resumes at the first chunk Piwigo hasn't acknowledged
+
+import base64
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from piwigo_api import PiwigoClient
+from state import StateStore
+from tags import get_registry
+
+
+CHUNK_SIZE = 1_000_000
+
+
+def file_md5(path, block_size=1 << 20) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_chunk(path, position, chunk_size) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(position * chunk_size)
+        return f.read(chunk_size)
+
+
+def existing_image_id(client: PiwigoClient, md5) -> str | None:
+    result = client.post('pwg.images.exist', {'md5sum_list': md5}) or {}
+    image_id = result.get(md5)
+    return str(image_id) if image_id else None
+
+
+def upload_file(client: PiwigoClient, path, info: dict, tags=(), state: StateStore = None,
+                chunk_size=CHUNK_SIZE, workers=4, md5=None) -> str:
+    # info holds the pwg.images.add fields (name, author, comment, categories), returns the Piwigo id
+    path = Path(path)
+    md5 = md5 or file_md5(path)
+
+    image_id = existing_image_id(client, md5)
+    if image_id:
+        # already on Piwigo, nothing to send
+        if state is not None:
+            state.clear_chunks(md5)
+        return image_id
+
+    size = path.stat().st_size
+    count = max(1, -(-size // chunk_size))
+    acked = state.acked_chunks(md5) if state is not None else set()
+
+    def send(position):
+        data = read_chunk(path, position, chunk_size)
+        client.post('pwg.images.addChunk', {
+            'data': base64.b64encode(data).decode('ascii'),
+            'original_sum': md5,
+            'type': 'file',
+            'position': position,
+        })
+        if state is not None:
+            state.ack_chunk(md5, position)
+
+    pending = [position for position in range(count) if position not in acked]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # list() so the first failed chunk raises here
+        list(pool.map(send, pending))
+
+    payload = {
+        'original_sum': md5,
+        'original_filename': path.name,
+        **info,
+    }
+    # pwg.images.add only takes tag ids
+    tag_ids = get_registry(client).ids(tags)
+    if tag_ids:
+        payload['tag_ids'] = ','.join(tag_ids)
+
+    try:
+        result = client.post('pwg.images.add', payload, retry_timeouts=False)
+    finally:
+        # add merges whatever chunks the server holds, after it runs (or fails) start over next time
+        if state is not None:
+            state.clear_chunks(md5)
+
+    return str(result['image_id'])
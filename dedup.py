@@ -0,0 +1,104 @@
+# content hash check run before any browser work
+# a file is skipped when the same bytes were already uploaded, under any filename or folder
+# hashes are cached in state.db by (path, size, mtime), so rescanning a big folder only reads new files
+
+import argparse
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from chunked_upload import file_md5
+from piwigo_api import PiwigoClient, PiwigoError, get_client
+from state import StateStore, open_state
+
+
+# md5 sums per pwg.images.exist request
+EXIST_BATCH = 100
+
+
+def hash_files(paths, state: StateStore, workers=8) -> dict[Path, str]:
+    def one(path):
+        st = path.stat()
+        md5 = state.cached_hash(path, st.st_size, st.st_mtime_ns)
+        if md5 is None:
+            md5 = file_md5(path)
+            state.store_hash(path, st.st_size, st.st_mtime_ns, md5)
+        return path, md5
+
+    # hashlib releases the GIL on large reads, threads are enough here
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(pool.map(one, [Path(p) for p in paths]))
+
+
+def remote_matches(client: PiwigoClient, md5s, batch=EXIST_BATCH) -> dict[str, str]:
+    # md5 -> Piwigo id for every sum Piwigo already has
+    md5s = list(md5s)
+    found = {}
+    for i in range(0, len(md5s), batch):
+        result = client.post('pwg.images.exist', {'md5sum_list': ','.join(md5s[i:i + batch])}) or {}
+        for md5, image_id in result.items():
+            if image_id:
+                found[md5] = str(image_id)
+    return found
+
+
+def find_duplicates(paths, state: StateStore, client: PiwigoClient = None, workers=8):
+    # returns (path -> md5, path -> Piwigo id it duplicates, path -> earlier path with the same bytes in this batch)
+    hashes = hash_files(paths, state, workers)
+
+    duplicates = {}
+    unknown = set()
+    for path, md5 in hashes.items():
+        piwigo_id = state.piwigo_id_for_md5(md5)
+        if piwigo_id:
+            duplicates[path] = piwigo_id
+        else:
+            unknown.add(md5)
+
+    if client is not None and unknown:
+        try:
+            remote = remote_matches(client, unknown)
+        except PiwigoError as e:
+            # not worth stopping a run over, the upload itself will still go through
+            print(f'Could not check Piwigo for duplicates: {e}')
+            remote = {}
+
+        for path, md5 in hashes.items():
+            if md5 in remote:
+                duplicates[path] = remote[md5]
+
+    # copies inside the batch itself, only the first one gets uploaded
+    first = {}
+    repeats = {}
+    for path, md5 in hashes.items():
+        if path in duplicates:
+            continue
+        if md5 in first:
+            repeats[path] = first[md5]
+        else:
+            first[md5] = path
+
+    return hashes, duplicates, repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List files in a folder that are already on Piwigo')
+    parser.add_argument('directory')
+    parser.add_argument('--workers', type=int, default=8, help='files hashed in parallel')
+    parser.add_argument('--local-only', action='store_true', help="don't ask Piwigo, only check state.db")
+    args = parser.parse_args()
+
+    paths = [p for p in Path(args.directory).expanduser().iterdir() if p.is_file()]
+    client = None if args.local_only else get_client()
+    _, duplicates, repeats = find_duplicates(paths, open_state(), client, args.workers)
+
+    for path, piwigo_id in duplicates.items():
+        print(f'{path}\talready on Piwigo as {piwigo_id}')
+    for path, original in repeats.items():
+        print(f'{path}\tsame file as {original}')
+
+    print(f'{len(paths)} files, {len(duplicates)} already uploaded, {len(repeats)} repeated in this folder')
+
+
+if __name__ == '__main__':
+    main()
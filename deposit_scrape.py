@@ -0,0 +1,222 @@
+# title, author and keywords from a Deposit Photos page in one go
+# parse_deposit_html works on saved HTML, so it runs without a browser or network
+# fetch_deposit gets the page over a pooled HTTP session, main.py falls back to the browser when that isn't enough
+
+import json
+import os
+import re
+
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from ratelimit import get_limiter
+
+
+load_dotenv()
+
+SEARCH_URL = os.getenv('DEPOSIT_SEARCH_URL', 'https://depositphotos.com/search/')
+NOT_FOUND_TITLE = 'Sorry, but we haven\'t found anything'
+MAX_KEYWORDS = 50
+
+# classes the browser scraper reads
+AUTHOR_CLASS = '_wdeBj'
+KEYWORD_CLASS = '_U57rH'
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+@dataclass
+class DepositInfo:
+    url: str = ''
+    title: str = ''
+    author: str = ''
+    keywords: list[str] = field(default_factory=list)
+
+    @property
+    def not_found(self):
+        return self.title == NOT_FOUND_TITLE
+
+    @property
+    def complete(self):
+        return bool(self.title and (self.not_found or (self.author and self.keywords)))
+
+
+def clean_title(title):
+    title = title.strip()
+    if title.endswith(' — Photo'):
+        title = title.removesuffix(' — Photo')
+
+    elif title.endswith(' — Vector'):
+        title = title.removesuffix(' — Vector')
+
+    return title
+
+
+def clean_author(author):
+    author = author.strip()
+    if 'Photo by ' in author:
+        _, _, author = author.partition('Photo by ')
+    elif 'Vector by ' in author:
+        _, _, author = author.partition('Vector by ')
+
+    return author.strip()
+
+
+def clean_keywords(keywords):
+    keywords = [k.strip().lower() for k in keywords]
+    return [k for k in keywords if k][:MAX_KEYWORDS]
+
+
+class _DepositParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.h1 = None
+        self.author = None
+        self.keyword_lists = []
+        self.json_ld = []
+
+        # (kind, depth) of the elements being captured right now
+        self.capturing = []
+        self.text = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        self.stack.append(tag)
+        depth = len(self.stack)
+
+        if tag == 'h1' and self.h1 is None:
+            self._start('h1', depth)
+        elif AUTHOR_CLASS in classes and self.author is None:
+            self._start('author', depth)
+        elif KEYWORD_CLASS in classes:
+            self.keyword_lists.append([])
+            self._start('keywords', depth)
+        elif tag == 'li' and any(kind == 'keywords' for kind, _ in self.capturing):
+            self._start('li', depth)
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self._start('json_ld', depth)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS or tag not in self.stack:
+            return
+
+        # close anything left open inside this element as well
+        while self.stack:
+            depth = len(self.stack)
+            while self.capturing and self.capturing[-1][1] == depth:
+                self._finish(self.capturing.pop()[0])
+            if self.stack.pop() == tag:
+                break
+
+    def handle_data(self, data):
+        for kind, _ in self.capturing:
+            self.text[kind].append(data)
+
+    def _start(self, kind, depth):
+        self.capturing.append((kind, depth))
+        self.text[kind] = []
+
+    def _finish(self, kind):
+        text = ''.join(self.text.pop(kind, []))
+        if kind == 'json_ld':
+            self.json_ld.append(text)
+            return
+
+        text = re.sub(r'\s+', ' ', text).strip()
+        if kind == 'h1':
+            self.h1 = text
+        elif kind == 'author':
+            self.author = text
+        elif kind == 'li' and self.keyword_lists:
+            self.keyword_lists[-1].append(text)
+
+
+def _walk_json(value):
+    if isinstance(value, dict):
+        yield value
+        for child in value.values():
+            yield from _walk_json(child)
+    elif isinstance(value, list):
+        for child in value:
+            yield from _walk_json(child)
+
+
+def _from_json_ld(blocks) -> DepositInfo:
+    info = DepositInfo()
+    for block in blocks:
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+
+        for node in _walk_json(data):
+            if not node.get('keywords') and not node.get('contentUrl'):
+                continue
+
+            info.title = info.title or str(node.get('name') or node.get('headline') or '')
+
+            person = node.get('author') or node.get('creator') or {}
+            if isinstance(person, list):
+                person = person[0] if person else {}
+            info.author = info.author or str(person.get('name', '') if isinstance(person, dict) else person)
+
+            keywords = node.get('keywords') or []
+            if isinstance(keywords, str):
+                keywords = keywords.split(',')
+            info.keywords = info.keywords or [str(k) for k in keywords]
+    return info
+
+
+def parse_deposit_html(html, url='') -> DepositInfo:
+    parser = _DepositParser()
+    parser.feed(html)
+    parser.close()
+
+    structured = _from_json_ld(parser.json_ld)
+
+    # the rendered page wins, it is what the browser scraper always read
+    keywords = parser.keyword_lists[-1] if parser.keyword_lists else structured.keywords
+    return DepositInfo(
+        url=url,
+        title=clean_title(parser.h1 or structured.title),
+        author=clean_author(parser.author or structured.author),
+        keywords=clean_keywords(keywords),
+    )
+
+
+_session = None
+
+
+def session() -> requests.Session:
+    global _session
+
+    if _session is None:
+        _session = requests.Session()
+        _session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_maxsize=16)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+    return _session
+
+
+def fetch_deposit(deposit_id, timeout=15) -> DepositInfo:
+    # the search page redirects to the photo page, r.url is the source URL the browser would have shown
+    with get_limiter('deposit').slot() as slot:
+        r = session().get(SEARCH_URL + deposit_id, timeout=timeout)
+        slot.status(r.status_code, r.headers.get('Retry-After'))
+    r.raise_for_status()
+    return parse_deposit_html(r.text, r.url)
@@ -0,0 +1,10 @@
+# the description template every upload gets, shared by main.py and the repair tools
+
+
+def build_description(alt_text, deposit_url, author):
+    return f"""
+Alt Text: {alt_text}
+Source URL: {deposit_url}
+Publisher: DepositPhotos
+Attribution: {author}/DepositPhotos
+"""
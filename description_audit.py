@@ -1,41 +1,21 @@
+import argparse
 import csv
-import os
+import hashlib
 import re
-import requests
-from dotenv import load_dotenv
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from tqdm import tqdm
 except ImportError:
     tqdm = None
 
+from piwigo_api import api_post, get_client
+from state import open_state
 
-load_dotenv()
-API_KEY = os.getenv("API_KEY")
-if not API_KEY:
-    raise RuntimeError("API Key not found")
-
-HEADERS = {"X-PIWIGO-API": API_KEY}
-PIWIGO_URL = "https://mines.piwigo.com/ws.php?format=json"
-
-
-def api_post(method: str, data: dict):
-    payload = {"method": method, **data}
-    r = requests.post(PIWIGO_URL, headers=HEADERS, data=payload, timeout=30)
-
-    text = r.text or ""
-    if r.status_code != 200:
-        raise RuntimeError(f"HTTP {r.status_code} from Piwigo: {text[:300]}")
-
-    try:
-        js = r.json()
-    except Exception:
-        raise RuntimeError(f"Non-JSON response from Piwigo: {text[:300]}")
-
-    if js.get("stat") == "fail":
-        raise RuntimeError(f"{method} failed: {js.get('err')} {js.get('message')}")
 
-    return js.get("result")
+get_client()  # fail early if API_KEY is missing
 
 
 def extract_title_and_description(info: dict) -> tuple[str, str]:
@@ -59,89 +39,157 @@ def extract_title_and_description(info: dict) -> tuple[str, str]:
     return str(title), str(description)
 
 
-def load_piwigo_ids_from_completed(path="completed.tsv") -> list[str]:
-    ids = []
-    with open(path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter="\t")
-        next(reader, None)  # header
-        for row in reader:
-            if not row:
-                continue
-            if len(row) < 8:
-                continue
-            pid = (row[7] or "").strip()
-            if pid:
-                ids.append(pid)
-
-    # de-dupe while preserving order
-    seen = set()
-    out = []
-    for pid in ids:
-        if pid not in seen:
-            seen.add(pid)
-            out.append(pid)
-    return out
-
-
-def main():
-    piwigo_ids = load_piwigo_ids_from_completed("completed.tsv")
+ALT_TEXT_RE = re.compile(r"Alt\s*Text\s*:", re.IGNORECASE)
+
+# main.py uploads everything into this album
+UPLOAD_CATEGORY = 3
+
+
+def fetch_category_images(category_id, per_page=500) -> dict[str, dict]:
+    # one request per page of images instead of one getInfo per image
+    infos = {}
+    page = 0
+    while True:
+        result = api_post("pwg.categories.getImages", {
+            "cat_id": category_id,
+            "per_page": per_page,
+            "page": page,
+        })
+        images = (result or {}).get("images", [])
+        for image in images:
+            infos[str(image.get("id"))] = image
+
+        if len(images) < per_page:
+            return infos
+        page += 1
+
+
+# whichever of these the response has, any edit on Piwigo changes at least one
+FINGERPRINT_FIELDS = ("name", "comment", "lastmodified", "date_available", "date_creation")
+
+
+def fingerprint(info: dict) -> str:
+    parts = [str(info.get(field) or "") for field in FINGERPRINT_FIELDS]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def audit_image(image_id, info=None) -> tuple[list[str], str | None]:
+    # returns the report row and the image fingerprint (None on error),
+    # info is fetched with getInfo when the listing didn't have it
+    try:
+        if info is None:
+            info = api_post("pwg.images.getInfo", {"image_id": image_id})
+        title, desc = extract_title_and_description(info)
+    except Exception as e:
+        return [image_id, "", "NO", f"ERROR: {e}"], None
+
+    if not desc.strip():
+        status = "MISSING_DESCRIPTION"
+        has_alt_text = False
+    else:
+        has_alt_text = bool(ALT_TEXT_RE.search(desc))
+        status = "OK" if has_alt_text else "MISSING_CUSTOM_DESCRIPTION"
+
+    # Don't dump the full description into the TSV (it can be huge / multiline).
+    # We just record whether the marker exists.
+    return [image_id, title, "YES" if has_alt_text else "NO", status], fingerprint(info)
+
+
+def main(concurrency=8, categories=(UPLOAD_CATEGORY,), incremental=False):
+    if incremental and not categories:
+        # without a listing every image needs getInfo anyway, so there is nothing to skip
+        raise ValueError("--incremental needs the album listing, it can't be combined with --no-listing")
+
+    state = open_state()
+    # completed.tsv order, de-duped, straight from the state index
+    piwigo_ids = state.piwigo_ids()
     if not piwigo_ids:
         print("No Piwigo IDs found in completed.tsv")
         return
 
+    listed = {}
+    for category_id in categories:
+        try:
+            listed.update(fetch_category_images(category_id))
+        except Exception as e:
+            # not fatal, those images just fall back to getInfo
+            print(f"Could not list category {category_id}: {e}")
+
+    previous = state.audit_results() if incremental else {}
+
+    def unchanged(pid) -> bool:
+        old = previous.get(pid)
+        if old is None or old["fingerprint"] is None:
+            return False
+        # outside the listed albums only getInfo has a fresh fingerprint, and it has the description too
+        return pid in listed and fingerprint(listed[pid]) == old["fingerprint"]
+
+    todo = [pid for pid in piwigo_ids if not unchanged(pid)]
+    if incremental:
+        print(f"{len(piwigo_ids) - len(todo)} unchanged in the album listing since the last audit, "
+              f"checking {len(todo)}")
+    if listed:
+        print(f"Listed {len(listed)} images, {sum(1 for pid in todo if pid not in listed)} need getInfo")
+
+    todo_set = set(todo)
+
+    def check(pid):
+        if pid not in todo_set:
+            old = previous[pid]
+            return [pid, old["title"], old["has_alt_text"], old["status"]], None, False
+        row, fp = audit_image(pid, listed.get(pid))
+        return row, fp, True
+
+    fresh = []
+
     report_path = "description_pattern_audit.tsv"
-    with open(report_path, "w", newline="", encoding="utf-8") as out_f:
+    with open(report_path, "w", newline="", encoding="utf-8") as out_f, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
         w = csv.writer(out_f, delimiter="\t")
         w.writerow(["PiwigoID", "Title", "DescriptionHasAltText", "Status"])
 
-        iterator = piwigo_ids
+        # map keeps the completed.tsv order no matter which request finishes first
+        results = pool.map(check, piwigo_ids)
         if tqdm is not None:
-            iterator = tqdm(piwigo_ids, desc="Auditing descriptions", unit="img")
-
-        ok_count = 0
-        missing_desc = 0
-        missing_custom = 0
-        error_count = 0
-
-        alt_text_re = re.compile(r"Alt\s*Text\s*:", re.IGNORECASE)
-
-        for image_id in iterator:
-            try:
-                info = api_post("pwg.images.getInfo", {"image_id": image_id})
-                title, desc = extract_title_and_description(info)
-
-                if not desc.strip():
-                    status = "MISSING_DESCRIPTION"
-                    has_alt_text = False
-                    missing_desc += 1
-                else:
-                    has_alt_text = bool(alt_text_re.search(desc))
-                    if has_alt_text:
-                        status = "OK"
-                        ok_count += 1
-                    else:
-                        status = "MISSING_CUSTOM_DESCRIPTION"
-                        missing_custom += 1
-
-                # Don't dump the full description into the TSV (it can be huge / multiline).
-                # We just record whether the marker exists.
-                w.writerow([image_id, title, "YES" if has_alt_text else "NO", status])
-
-                if tqdm is None and status != "OK":
-                    print(f"{status}: {image_id}")
-
-            except Exception as e:
-                error_count += 1
-                w.writerow([image_id, "", "NO", f"ERROR: {e}"])
-                if tqdm is None:
-                    print(f"ERROR: {image_id}: {e}")
+            results = tqdm(results, total=len(piwigo_ids), desc="Auditing descriptions", unit="img")
+
+        counts = Counter()
+        for row, fp, checked in results:
+            status = row[3]
+            counts["ERROR" if status.startswith("ERROR") else status] += 1
+            w.writerow(row)
+
+            if checked:
+                fresh.append((row[0], fp, row[1], row[2], status))
+                if len(fresh) >= 500:
+                    state.store_audits(fresh)
+                    fresh = []
+
+            if tqdm is None and checked and status != "OK":
+                print(f"{status}: {row[0]}")
+
+    # the next --incremental run compares against these
+    state.store_audits(fresh)
 
     print(f"Wrote report: {report_path}")
-    print(f"OK: {ok_count}")
-    print(f"Missing description: {missing_desc}")
-    print(f"Missing custom marker (Alt Text:): {missing_custom}")
-    print(f"Errors: {error_count}")
+    print(f"OK: {counts['OK']}")
+    print(f"Missing description: {counts['MISSING_DESCRIPTION']}")
+    print(f"Missing custom marker (Alt Text:): {counts['MISSING_CUSTOM_DESCRIPTION']}")
+    print(f"Errors: {counts['ERROR']}")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Check Piwigo descriptions of uploaded images for the Alt Text marker")
+    parser.add_argument("--concurrency", type=int, default=8, help="max parallel requests to Piwigo")
+    parser.add_argument("--category", type=int, action="append", dest="categories",
+                        help=f"album to list in bulk (default {UPLOAD_CATEGORY}), repeatable")
+    parser.add_argument("--no-listing", action="store_true", help="skip album listing and call getInfo per image")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only check images that are new or changed since the last audit")
+    args = parser.parse_args()
+
+    if args.incremental and args.no_listing:
+        parser.error("--incremental compares the album listing, it can't be combined with --no-listing")
+
+    categories = () if args.no_listing else (args.categories or (UPLOAD_CATEGORY,))
+    main(args.concurrency, categories, args.incremental)
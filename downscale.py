@@ -0,0 +1,120 @@
+# smaller copies of oversized images for the alt text generator
+# the original file is still what gets uploaded to Piwigo
+# derivatives are cached by content hash, so reruns never re-encode the same image
+
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+
+# the alt text generator rejects anything this size or bigger
+MAX_BYTES = 19_500_000
+DERIVATIVE_DIR = Path('derivatives')
+
+# longest side of a derivative, far more than the alt text generator needs
+MAX_SIDE = 4096
+QUALITIES = (90, 80, 70, 60, 50)
+
+
+def pillow_available() -> bool:
+    return importlib.util.find_spec('PIL') is not None
+
+
+def content_hash(path, block_size=1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def shrink(path, out, max_bytes=MAX_BYTES, max_side=MAX_SIDE):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+
+        while True:
+            image.thumbnail((max_side, max_side))
+
+            for quality in QUALITIES:
+                image.save(out, 'JPEG', quality=quality, optimize=True)
+                if out.stat().st_size < max_bytes:
+                    return
+
+            # still too big at the lowest quality, lose some resolution
+            max_side //= 2
+            if max_side < 256:
+                raise RuntimeError(f'Could not shrink {path} under {max_bytes} bytes')
+
+
+def alt_text_source(path, max_bytes=MAX_BYTES, cache_dir=DERIVATIVE_DIR) -> Path:
+    # the file to hand the alt text generator, the original when it's small enough
+    path = Path(path)
+    if path.stat().st_size < max_bytes:
+        return path
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    out = cache_dir / f'{content_hash(path)}.jpg'
+    if out.exists():
+        return out
+
+    # encode next to the cache entry and rename, a killed worker never leaves a broken derivative
+    tmp = out.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        shrink(path, tmp, max_bytes)
+        tmp.replace(out)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    return out
+
+
+class Downscaler:
+    # encodes oversized images on a process pool while the rest of the run carries on
+    def __init__(self, workers=None, max_bytes=MAX_BYTES, cache_dir=DERIVATIVE_DIR):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.available = pillow_available()
+        self.pool = None
+        self.workers = workers
+
+    def needed(self, path) -> bool:
+        return os.path.getsize(path) >= self.max_bytes
+
+    def submit(self, path) -> Future:
+        if not self.needed(path):
+            done = Future()
+            done.set_result(Path(path))
+            return done
+
+        if self.pool is None:
+            # spawn, forking a process that is running playwright threads isn't safe
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.pool.submit(alt_text_source, path, self.max_bytes, self.cache_dir)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+
+def prepare_derivatives(paths, workers=None, max_bytes=MAX_BYTES) -> dict[Path, Path | Exception]:
+    # shrink a batch up front, returns original -> derivative (or the error)
+    downscaler = Downscaler(workers, max_bytes)
+    try:
+        futures = {Path(p): downscaler.submit(p) for p in paths}
+        results = {}
+        for path, future in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                results[path] = e
+        return results
+    finally:
+        downscaler.close()
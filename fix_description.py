@@ -1,29 +1,30 @@
-import csv
+from description import build_description
+from state import open_state
 
 
-def get_description(reader, image_id, column):
-    for row in reader:
-        if row[column] == image_id:
-            alt_text = row[5]
-            deposit_url = row[2]
-            title = row[3]
-            author = row[4]
+def get_description(state, image_id, piwigo):
+    if piwigo:
+        row = state.by_piwigo_id(image_id)
+    else:
+        row = state.get(image_id)
 
-            print(f'\nTitle:\n{title}')
+    if row is None:
+        return
 
-            print(f"""
-Alt Text: {alt_text}
-Source URL: {deposit_url}
-Publisher: DepositPhotos
-Attribution: {author}/DepositPhotos
-                            """)
+    alt_text = row['alt_text']
+    deposit_url = row['source_url']
+    title = row['title']
+    author = row['author']
 
-            break
+    print(f'\nTitle:\n{title}')
+
+    print(build_description(alt_text, deposit_url, author))
 
 
 def main():
+    state = open_state()
+
     image_id = ''
-    piwigo = False
     while image_id != 'exit':
         print('Type exit to exit')
         image_id = str(input('Deposit/Piwigo ID: '))
@@ -38,19 +39,11 @@ def main():
         elif s.endswith("_XL"):
             s = s.removesuffix("_XL")
 
-        if 4 <= len(s) <= 5:
-            piwigo = True
+        piwigo = 4 <= len(s) <= 5
 
         image_id = s
 
-        with open('completed.tsv', 'r', newline='', encoding='utf-8') as completed_tsv:
-            reader = csv.reader(completed_tsv, delimiter='\t')
-            next(reader)
-
-            if piwigo:
-                get_description(reader, image_id, 7)
-            else:
-                get_description(reader, image_id, 1)
+        get_description(state, image_id, piwigo)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,66 +1,203 @@
+# checks completed.tsv row by row against RULES and reports anything that looks wrong
+# only an 8 byte hash of each value is kept for the duplicate check, so memory stays small on huge files
+# --format json/tsv prints one finding per line for other tools, the exit code is 1 when anything was found
+# --follow keeps watching the file and checks rows as main.py appends them
+
+import argparse
 import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+from dataclasses import dataclass
+from typing import Callable
+
+
+COMPLETED = 'completed.tsv'
+
+COLUMNS = ['LocalPath', 'DepositID', 'SourceURL', 'Title', 'Author', 'AltText', 'Keywords', 'PiwigoID']
+
+# the same author shows up on many photos, every other column should be unique
+DUPLICATE_COLUMNS = [c for c in COLUMNS if c != 'Author']
+
+
+@dataclass
+class Rule:
+    name: str
+    # True when the row breaks the rule, rows are dicts keyed by COLUMNS
+    check: Callable[[dict], bool]
+    message: str
+    column: str = ''
+
+
+def _empty(column):
+    return Rule('empty', lambda row: not row[column].strip(), f'{column} is empty', column)
+
+
+RULES = [
+    *[_empty(column) for column in COLUMNS],
+    Rule('blank_source', lambda row: row['SourceURL'] == 'about:blank', 'has an incorrect source url', 'SourceURL'),
+    Rule('long_title', lambda row: len(row['Title'].split()) >= 20, 'has a very long title', 'Title'),
+    Rule('few_keywords', lambda row: len([k for k in row['Keywords'].split(';') if k]) < 10, 'has few keywords',
+         'Keywords'),
+]
+
+
+@dataclass
+class Finding:
+    row: int
+    rule: str
+    column: str
+    message: str
+
+    def text(self):
+        return f'Row {self.row}: {self.message}'
+
+
+def fingerprint(value) -> bytes:
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+
+
+class Validator:
+    def __init__(self, rules=RULES, duplicate_columns=DUPLICATE_COLUMNS):
+        self.rules = rules
+        self.duplicate_columns = duplicate_columns
+        self.reset()
+
+    def reset(self):
+        # value hash -> first row it was seen on, per column
+        self.seen = {column: {} for column in self.duplicate_columns}
+        self.rows = 0
+        self.findings = 0
+
+    def check(self, row_number, values) -> list[Finding]:
+        self.rows += 1
+        findings = []
+
+        if not any(v.strip() for v in values):
+            findings.append(Finding(row_number, 'empty_row', '', 'row is empty'))
+            self.findings += 1
+            return findings
 
-def main():
-    error_code = 0
-
-    seen = [dict() for _ in range(8)]
-    column_names = [
-        'LocalPath',
-        'DepositID',
-        'SourceURL',
-        'Title',
-        'Author',
-        'AltText',
-        'Keywords',
-        'PiwigoID'
-    ]
-
-    with open('completed.tsv', 'r', newline='', encoding='utf-8') as completed_tsv:
-        reader = csv.reader(completed_tsv, delimiter='\t')
-        next(reader)
-
-        row_number = 1
-        for row in reader:
-            row_number += 1
-
-            if not row:
-                print(f'Row {row_number} is empty')
-                error_code = 1
-
-            for col_idx, value in enumerate(row):
-                if col_idx == 4:  # skip Author column
-                    continue
-
-                if value in seen[col_idx]:
-                    first_row = seen[col_idx][value]
-                    print(
-                        f'Duplicate detected in column {col_idx + 1} ({column_names[col_idx]}): '
-                        f'"{value}" (rows {first_row} and {row_number})'
-                    )
-                    error_code = 1
-                else:
-                    seen[col_idx][value] = row_number
-
-            for i in range(0, 8):
-                if not row[i]:
-                    print(f'Row {row_number}, Column {i + 1} is empty')
-                    error_code = 1
-
-            if row[2] == 'about:blank':
-                print(f'Row {row_number} has an incorrect source url (C3)')
-                error_code = 1
-
-            if len(row[3].split()) >= 20:
-                print(f'Row {row_number} has a very long title')
-                error_code = 1
-
-            if len(row[6].split(';')) < 10:
-                print(f'Row {row_number} has few keywords')
-                error_code = 1
-
-    if not error_code:
-        print('All tests passed!')
+        if len(values) < len(COLUMNS):
+            findings.append(Finding(row_number, 'short_row', '', f'has {len(values)} of {len(COLUMNS)} columns'))
+            values = values + [''] * (len(COLUMNS) - len(values))
+        row = dict(zip(COLUMNS, values))
+
+        for column in self.duplicate_columns:
+            if not row[column]:
+                continue
+            key = fingerprint(row[column])
+            first = self.seen[column].setdefault(key, row_number)
+            if first != row_number:
+                findings.append(Finding(
+                    row_number, 'duplicate', column, f'duplicate {column} "{row[column]}" (first seen on row {first})'
+                ))
+
+        for rule in self.rules:
+            if rule.check(row):
+                findings.append(Finding(row_number, rule.name, rule.column, rule.message))
+
+        self.findings += len(findings)
+        return findings
+
+
+class Output:
+    def __init__(self, fmt='text', stream=sys.stdout):
+        self.fmt = fmt
+        self.stream = stream
+        if fmt == 'tsv':
+            self.writer = csv.writer(stream, delimiter='\t', lineterminator='\n')
+            self.writer.writerow(['Row', 'Rule', 'Column', 'Message'])
+
+    def write(self, finding: Finding):
+        if self.fmt == 'json':
+            self.stream.write(json.dumps(finding.__dict__) + '\n')
+        elif self.fmt == 'tsv':
+            self.writer.writerow([finding.row, finding.rule, finding.column, finding.message])
+        else:
+            self.stream.write(finding.text() + '\n')
+
+    def flush(self):
+        self.stream.flush()
+
+
+class _Rewritten(Exception):
+    pass
+
+
+def _lines(f, path, follow, poll, idle):
+    # complete lines only, a row main.py is halfway through writing waits for its newline
+    inode = os.fstat(f.fileno()).st_ino
+    pending = ''
+    while True:
+        line = f.readline()
+        if line:
+            pending += line
+            if pending.endswith('\n'):
+                yield pending
+                pending = ''
+            continue
+
+        if not follow:
+            if pending:
+                yield pending
+            return
+
+        idle()
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        if st is not None and (st.st_ino != inode or st.st_size < f.tell()):
+            # state.py export rewrote the file
+            raise _Rewritten
+        time.sleep(poll)
+
+
+def validate(path, validator: Validator, output: Output, follow=False, poll=1.0):
+    while True:
+        try:
+            with open(path, 'r', newline='', encoding='utf-8') as f:
+                # csv pulls more lines itself when a quoted field spans several
+                reader = csv.reader(_lines(f, path, follow, poll, output.flush), delimiter='\t')
+                next(reader, None)  # header
+                for row_number, values in enumerate(reader, 2):
+                    for finding in validator.check(row_number, values):
+                        output.write(finding)
+            output.flush()
+            return
+        except _Rewritten:
+            # start over on the new file
+            validator.reset()
+
+
+def main(path=COMPLETED, fmt='text', follow=False):
+    validator = Validator()
+    output = Output(fmt)
+
+    try:
+        validate(path, validator, output, follow)
+    except KeyboardInterrupt:
+        pass
+
+    if fmt == 'text':
+        if validator.findings:
+            print(f'{validator.findings} problems in {validator.rows} rows')
+        else:
+            print('All tests passed!')
+
+    return 1 if validator.findings else 0
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Check completed.tsv for rows that need a manual look')
+    parser.add_argument('path', nargs='?', default=COMPLETED)
+    parser.add_argument('--format', choices=['text', 'json', 'tsv'], default='text',
+                        help='json and tsv print one finding per line')
+    parser.add_argument('--follow', action='store_true', help='keep checking rows as they are appended (Ctrl+C to stop)')
+    args = parser.parse_args()
+
+    sys.exit(main(args.path, args.format, args.follow))
@@ -1,5 +1,11 @@
 import csv
 
+from downscale import pillow_available, prepare_derivatives
+
+
+TOO_LARGE = 'File is too large to generate alt text. Shrink file and run again'
+
+
 def main():
     image_paths = []
 
@@ -7,12 +13,28 @@ def main():
         reader = csv.reader(failed_tsv, delimiter='\t')
 
         for row in reader:
-            if row[3] == 'File is too large to generate alt text. Shrink file and run again':
+            if len(row) > 3 and row[3] == TOO_LARGE:
                 image_paths.append(row[0])
 
-    command = 'cp ' + ' '.join(image_paths) + ' .'
-    print(command)
-    print('https://compressjpeg.com/')
+    if not image_paths:
+        print('No files were too large.')
+        return
+
+    if not pillow_available():
+        command = 'cp ' + ' '.join(image_paths) + ' .'
+        print(command)
+        print('https://compressjpeg.com/')
+        print('Or install Pillow (pip install -r requirements.txt) and run this again to shrink them locally.')
+        return
+
+    # main.py finds these in the derivative cache on its next run, no manual step needed
+    for original, result in prepare_derivatives(image_paths).items():
+        if isinstance(result, Exception):
+            print(f'{original}: {result}')
+        else:
+            print(f'{original} -> {result}')
+
+    print('Run main.py again (or main.py --retry-failed) to finish these images.')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
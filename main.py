@@ -1,34 +1,68 @@
+import argparse
 import csv
+import itertools
 import os
-import requests
+import queue
+import socket
+import threading
+import time
 
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from pathlib import Path
-from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright, Page
+from playwright.sync_api import sync_playwright, Page, TimeoutError as PlaywrightTimeoutError
+
+from alt_text import BACKENDS, make_backend
+from browser import BlockConfig, BrowserMemory, BrowserSupervisor, TrafficStats, block_requests, open_context
+from chunked_upload import CHUNK_SIZE, file_md5, upload_file
+from dedup import find_duplicates
+from description import build_description
+from deposit_scrape import (
+    NOT_FOUND_TITLE, SEARCH_URL, DepositInfo, clean_author, clean_keywords, clean_title, fetch_deposit,
+    parse_deposit_html,
+)
+from downscale import Downscaler
+from metrics import NULL_RECORD, Metrics, NullMetrics
+from piwigo_api import api_post, get_client
+from progress import Progress
+from ratelimit import get_limiter, set_log, summary as limits_summary
+from scanner import deposit_id_from_name, scan
+from set_copyright import CopyrightLog, admin_client, set_copyright
+from state import COMPLETED_HEADER, COPYRIGHTED, FAILED_HEADER, StateStore, open_state, shard_path, write_tsv
+from tags import get_registry, split_keywords
 
 
 # API
-load_dotenv()
-API_KEY = os.getenv('API_KEY')
-if not API_KEY:
-    raise RuntimeError('API Key not found')
-
-HEADERS = {'X-PIWIGO-API': API_KEY}
-
-
-def load_ids(datafile):
-    ids = set()
-    with open(datafile, 'r') as f:
-        reader = csv.reader(f, delimiter='\t')
-        next(reader) # skip header
-
-        for row in reader:
-            ids.add(row[1])  # id column
-
-    return ids
+get_client()  # fail early if API_KEY is missing
+
+TOO_LARGE = 'File is too large to generate alt text. Shrink file and run again'
+LEASE_LOST = 'Lease lost'
+UPLOAD_CATEGORY = 3
+
+
+KEYWORD_LIST = '._U57rH'
+
+# true once the last keyword list has items and its count held still for a couple of polls
+KEYWORDS_SETTLED = """
+(selector) => {
+    const lists = document.querySelectorAll(selector);
+    if (!lists.length) return false;
+
+    const count = lists[lists.length - 1].querySelectorAll('li').length;
+    const seen = window.__keywordWait || (window.__keywordWait = {count: -1, stable: 0});
+    if (count > 0 && count === seen.count) {
+        seen.stable += 1;
+    } else {
+        seen.count = count;
+        seen.stable = 0;
+    }
+    return seen.stable >= 2;
+}
+"""
 
 
-def load_lazy(page: Page):
+def scroll_with_keys(page: Page):
+    # the old fixed sequence, only used when the keyword list never shows up
     for i in range(2):
         page.keyboard.press('End')
         page.wait_for_timeout(250)
@@ -46,29 +80,22 @@ def load_lazy(page: Page):
     page.wait_for_timeout(250)
 
 
-def api_post(method: str, data: dict, files=None):
-    payload = {'method': method, **data}
-    r = requests.post(
-        'https://mines.piwigo.com/ws.php?format=json',
-        headers=HEADERS,
-        data=payload,
-        files=files,
-        timeout=30,
-    )
-
-    text = r.text or ''
-    if r.status_code != 200:
-        raise RuntimeError(f'HTTP {r.status_code} from Piwigo: {text[:300]}')
+def load_lazy(page: Page, timeout=5_000):
+    # returns as soon as the keyword list has rendered, instead of sleeping a fixed 3.25 s
+    list_locator = page.locator(KEYWORD_LIST).last
 
     try:
-        js = r.json()
-    except Exception:
-        raise RuntimeError(f'Non-JSON response from Piwigo: {text[:300]}')
+        if list_locator.count() == 0:
+            # the section only renders once the page is scrolled towards it
+            page.keyboard.press('End')
 
-    if js.get('stat') == 'fail':
-        raise RuntimeError(f'{method} failed: {js.get('err')} {js.get('message')}')
+        list_locator.wait_for(state='attached', timeout=timeout)
+        list_locator.scroll_into_view_if_needed(timeout=timeout)
 
-    return js['result']
+        page.evaluate('() => { delete window.__keywordWait; }')
+        page.wait_for_function(KEYWORDS_SETTLED, arg=KEYWORD_LIST, polling=100, timeout=timeout)
+    except PlaywrightTimeoutError:
+        scroll_with_keys(page)
 
 
 def ensure_header(path, header, delimiter='\t'):
@@ -89,196 +116,830 @@ ensure_header(
     ['LocalPath', 'DepositID', 'SourceURL', 'Title', 'Author', 'AltText', 'Keywords', 'PiwigoID']
 )
 
-print('Do not minimize the browser that opens, it will prevent some information from gathering.')
-directory_raw = input('Directory: ').strip()
-directory = Path(directory_raw).expanduser().resolve()
-
-def main():
-    file_too_large = False
-
-    total_photos = sum(1 for _ in directory.iterdir())
-
-    if total_photos == 0:
-        total_photos = -1
-
-    with open(COMPLETED, 'a') as completed_tsv, open(FAILED, 'w') as failed_tsv:
-        completed = csv.writer(completed_tsv, delimiter='\t')
-        failed = csv.writer(failed_tsv, delimiter='\t')
-
-        # header for write mode
-        failed.writerow(['LocalPath', 'DepositID', 'Stage', 'Error'])
 
-        # get completed ids
-        completed_ids = load_ids(COMPLETED)
-
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=False)
-            page = browser.new_page()
-
-            photo_count = 0
-            for filepath in directory.iterdir():
-                photo_count += 1
-
-                # skip other files
-                file = filepath.name
-                if not file.startswith('Depositphotos_') or not file.endswith('_XL.jpg'):
+class StageFailed(Exception):
+    # raised by a stage so the caller can write the failed.tsv row and move on
+    def __init__(self, stage, error):
+        super().__init__(str(error))
+        self.stage = stage
+
+
+@dataclass
+class Options:
+    workers: int = 1
+    uploaders: int = 2
+    retry_failed: bool = False
+    recursive: bool = False
+    # 'http' tries a plain request for the Deposit Photos page before rendering it in the browser
+    scraper: str = 'browser'
+    # abort images, fonts and tracker requests in the browser, see browser.py
+    block_requests: bool = True
+    # 'tailwind' (browser) or 'local' (captioning model), see alt_text.py
+    alt_text_backend: str = 'tailwind'
+    alt_text_workers: int | None = None
+    alt_text_batch: int = 8
+    # 'simple' sends the whole file in one addSimple request, 'chunked' uses addChunk + add
+    upload_mode: str = 'simple'
+    chunk_size: int = CHUNK_SIZE
+    chunk_workers: int = 4
+    # processes shrinking oversized images for the alt text generator, None = one per cpu
+    shrink_workers: int | None = None
+    # skip files whose content is already on Piwigo, checked before any browser work
+    dedup: bool = True
+    # set the copyright right after each upload instead of a set_copyright.py pass
+    copyright: bool = False
+    # None shows the browser only when there is a display, see browser.launch
+    headless: bool | None = None
+    hash_workers: int = 8
+    # per-image stage timings appended to this JSONL file, None turns timing off
+    metrics_path: str | None = 'metrics.jsonl'
+    # Prometheus text dump of the stage timings written at the end of the run
+    prometheus_path: str | None = None
+    # name of this worker when several processes share state.db, None for a normal run
+    shard: str | None = None
+    # seconds a claimed image stays reserved for a worker that stopped renewing it
+    lease_seconds: int = 600
+    # one Run ID for every shard of a run, a fresh timestamp when None
+    run_id: str | None = None
+    # images per browser context before it is swapped for a fresh one, 0 never
+    recycle_every: int = 200
+    # MB of chromium memory per worker that restarts the browser, 0 for no ceiling
+    max_browser_mb: int = 1500
+
+
+@dataclass
+class Job:
+    filepath: Path
+    deposit_id: str
+    alt_text: str = ''
+    deposit_url: str = ''
+    title: str = ''
+    author: str = ''
+    keywords: list[str] = field(default_factory=list)
+    piwigo_id: str = ''
+    # resolves to the file the alt text generator gets, a shrunk copy for oversized images
+    alt_text_source: Future | None = None
+    # alt text from a backend that runs ahead of the browser
+    alt_text_pending: Future | None = None
+    md5: str | None = None
+    # stages already finished, in this run or a previous one
+    done: set[str] = field(default_factory=set)
+    # stage timer, see metrics.py
+    metrics: object = NULL_RECORD
+
+    def restore(self, row, statuses):
+        # pick up whatever earlier runs checkpointed for this image
+        if statuses.get('alt_text') == 'done':
+            self.alt_text = row['alt_text'] or ''
+            self.done.add('alt_text')
+
+        if statuses.get('deposit') == 'done':
+            self.deposit_url = row['source_url'] or ''
+            self.title = row['title'] or ''
+            self.author = row['author'] or ''
+            self.keywords = [k for k in (row['keywords'] or '').split(';') if k]
+            self.done.add('deposit')
+
+
+class Recorder:
+    # completed.tsv and state writes shared by every worker thread
+    def __init__(self, completed_tsv, state: StateStore, run_id, options: Options):
+        self.lock = threading.Lock()
+        self.options = options
+        self.downscaler = Downscaler(options.shrink_workers)
+        if options.alt_text_backend == 'local':
+            # a serial run submits one image at a time, waiting for a batch to fill would only add max_wait per image
+            batch_size = options.alt_text_batch if options.workers > 1 else 1
+            self.alt_text = make_backend('local', state, workers=options.alt_text_workers, batch_size=batch_size)
+        else:
+            self.alt_text = make_backend(options.alt_text_backend, state)
+        self.hashes = {}
+        self.completed_tsv = completed_tsv
+        self.completed = csv.writer(completed_tsv, delimiter='\t')
+        self.state = state
+        self.run_id = run_id
+        self.progress = None
+        self.file_too_large = False
+        self.traffic = TrafficStats()
+        self.browser_memory = BrowserMemory()
+        self.block_config = BlockConfig.from_env(options.block_requests)
+        self.failures = []
+        self.leases_stop = threading.Event()
+        if options.metrics_path:
+            self.metrics = Metrics(self.log_path(options.metrics_path), run_id, self.log)
+        else:
+            self.metrics = NullMetrics()
+        get_client().on_retry = self.metrics.retry
+        set_log(self.log)
+        self.tags = get_registry().load()
+
+        self.copyrights = None
+        if options.copyright:
+            admin_client()  # fail early if the login doesn't work
+            self.copyrights = CopyrightLog(state, self.log_path(COPYRIGHTED))
+
+    def log_path(self, path):
+        # each shard writes its own copy of the append-only logs, state.py merge combines them
+        return shard_path(path, self.options.shard) if self.options.shard else path
+
+    def claim(self, deposit_id) -> bool:
+        if not self.options.shard:
+            return True
+        # finished by another shard since the scan, a plain read instead of taking the write lock for nothing
+        if self.state.is_completed(deposit_id):
+            return False
+        return self.state.claim(deposit_id, self.options.shard, self.options.lease_seconds)
+
+    def abandoned(self, files):
+        # after the walk: files other shards claimed and never finished, once their leases run out
+        # a live shard renews every lease_seconds / 3, so a lease whose expiry moves on is left to it,
+        # the ones that stand still belonged to a shard that stopped and are waited for
+        if not self.options.shard:
+            return
+
+        paths = {deposit_id_from_name(f.name): f for f in files}
+        first_seen = {}
+        live = set()
+        while True:
+            now = time.time()
+            waiting = []
+            for deposit_id, expires in self.state.other_leases(self.options.shard).items():
+                if deposit_id not in paths or deposit_id in live:
                     continue
+                if expires > first_seen.setdefault(deposit_id, expires):
+                    live.add(deposit_id)
+                elif expires < now:
+                    self.log(f'ID {deposit_id}: lease of a stopped worker ran out, taking it over')
+                    self.progress.taken_back()
+                    # prepare() claims it, or counts it as taken again if another shard was quicker
+                    live.add(deposit_id)
+                    yield paths[deposit_id]
+                else:
+                    waiting.append(expires)
+
+            if not waiting:
+                return
+            time.sleep(max(0.0, min(min(waiting) - now, self.options.lease_seconds / 3)) + 1)
+
+    def holds(self, job: Job) -> bool:
+        return not self.options.shard or self.state.holds_lease(job.deposit_id, self.options.shard)
+
+    def renew_leases(self):
+        # every lease this worker has, images that failed included, so no one retries them during this run
+        interval = self.options.lease_seconds / 3
+        while not self.leases_stop.wait(interval):
+            try:
+                self.state.renew_leases(self.options.shard, self.options.lease_seconds)
+            except Exception as e:
+                self.log(f'Could not renew leases: {e}')
+
+    def start_leases(self):
+        if self.options.shard:
+            threading.Thread(target=self.renew_leases, daemon=True).start()
+
+    def stop_leases(self):
+        if self.options.shard:
+            self.leases_stop.set()
+            self.state.release_all(self.options.shard)
+
+    def new_context(self, browser):
+        context = open_context(browser)
+        block_requests(context, self.block_config, self.traffic)
+        return context
+
+    def supervise(self, playwright) -> BrowserSupervisor:
+        return BrowserSupervisor(
+            playwright, self.options.headless, self.new_context,
+            recycle_every=self.options.recycle_every, max_mb=self.options.max_browser_mb,
+            memory=self.browser_memory, log=self.log,
+        )
+
+    def log(self, message=''):
+        if self.progress is not None:
+            self.progress.write(message)
+        else:
+            print(message)
+
+    def is_completed(self, deposit_id):
+        return self.state.is_completed(deposit_id)
+
+    def checkpoint(self, job: Job, stage):
+        # persist a stage as soon as it finishes so a later failure doesn't throw it away
+        if stage == 'alt_text':
+            fields = {'alt_text': job.alt_text}
+        else:
+            fields = {
+                'source_url': job.deposit_url,
+                'title': job.title,
+                'author': job.author,
+                'keywords': ';'.join(job.keywords),
+            }
+
+        self.state.record_stage(job.deposit_id, stage, local_path=str(job.filepath), **fields)
+        job.done.add(stage)
+        self.progress.stage_done(stage)
+
+    def fail(self, job: Job, stage, error):
+        if stage == LEASE_LOST:
+            # another worker has the image now, its result is the one that counts
+            job.metrics.finish('lease_lost', failed_stage=stage)
+            self.progress.taken_elsewhere()
+            return
+
+        self.state.record_failure(job.deposit_id, job.filepath, stage, error)
+        job.metrics.finish('failed', failed_stage=stage)
+        with self.lock:
+            self.failures.append([job.filepath, job.deposit_id, stage, error])
+            if error == TOO_LARGE:
+                self.file_too_large = True
+        self.progress.finished(failed=True)
+
+    def complete(self, job: Job):
+        self.state.complete(
+            job.deposit_id, job.filepath, job.deposit_url, job.title, job.author,
+            job.alt_text, job.keywords, job.piwigo_id, self.run_id, job.md5,
+        )
+        if self.options.shard:
+            self.state.release(job.deposit_id, self.options.shard)
+        with self.lock:
+            self.completed.writerow([
+                job.filepath, job.deposit_id, job.deposit_url, job.title, job.author,
+                job.alt_text, ';'.join(job.keywords), job.piwigo_id,
+            ])
+            self.completed_tsv.flush()
+
+        if self.copyrights is not None:
+            try:
+                with job.metrics.time('copyright'):
+                    set_copyright(admin_client(), [job.piwigo_id])
+                self.copyrights.record([job.piwigo_id])
+            except Exception as e:
+                # the upload still counts, set_copyright.py picks the image up later
+                self.log(f'ID {job.deposit_id}: could not set the copyright: {e}')
+
+        size = os.path.getsize(job.filepath)
+        job.metrics.finish('completed', uploaded_bytes=size)
+        self.progress.stage_done('upload')
+        self.progress.finished(uploaded_bytes=size)
+
+
+def generate_alt_text(page: Page, job: Job, recorder: Recorder):
+    if job.alt_text_pending is not None:
+        # started in prepare() by a backend that doesn't need the browser
+        try:
+            with job.metrics.time('alt_text_wait'):
+                return job.alt_text_pending.result()
+        except Exception as e:
+            raise StageFailed('Generating Alt Text', e)
 
-                # get photo id/search url from filename
-                deposit_id = file.removeprefix('Depositphotos_').removesuffix('_XL.jpg')
-                search_url = 'https://depositphotos.com/search/' + deposit_id
-
-                print(f'ID: {deposit_id}')
+    try:
+        with job.metrics.time('shrink_wait'):
+            source = job.alt_text_source.result()
+    except Exception as e:
+        raise StageFailed('Shrinking image', e)
 
-                if deposit_id in completed_ids:
-                    print(f'Already completed\n')
-                    continue
+    try:
+        with job.metrics.time('alt_text'):
+            return recorder.alt_text.generate(source, page, md5=job.md5, original=job.filepath)
+    except Exception as e:
+        raise StageFailed('Generating Alt Text', e)
 
-                if os.path.getsize(filepath) >= 19_500_000:
-                    file_too_large = True
-                    print(f'ID {deposit_id} is too large to generate alt text. Shrink file and run again')
-                    failed.writerow([filepath, deposit_id, 'Generating alt text', 'File is too large to generate alt text. Shrink file and run again'])
-                    continue
 
-                # generate alt text for image
-                try:
-                    page.goto(
-                        'https://www.tailwindapp.com/marketing/tools/image-alt-text-generator',
-                        wait_until='domcontentloaded',
-                    )
+def apply_deposit_info(job: Job, info: DepositInfo):
+    if info.not_found:
+        raise StageFailed('Gathering Title', 'Photo doesn\'t exist on deposit photos')
 
-                    page.wait_for_selector('input[type="file"]', timeout=10_000)
-                    page.locator('input[type="file"]').set_input_files(str(filepath))
+    job.deposit_url = info.url or job.deposit_url
+    job.title = info.title
+    job.author = info.author
+    job.keywords = info.keywords
 
-                    alt_text_locator = page.locator('textarea')
-                    alt_text_locator.wait_for(timeout=10_000)
 
-                    alt_text = alt_text_locator.input_value().strip()
-                except Exception as e:
-                    print(f'ID {deposit_id} failed to generate alt text')
-                    failed.writerow([filepath, deposit_id, 'Generating Alt Text', str(e)])
-                    continue
+def scrape_with_locators(page: Page, job: Job):
+    # element by element, only used when the page source couldn't be parsed
 
-                # pull info from deposit photos
-                page.goto(search_url)
+    # author
+    try:
+        with job.metrics.time('deposit_author'):
+            author_locator = page.locator('._wdeBj')
+            author_locator.wait_for(timeout=10_000)
 
-                deposit_url = page.url
-                print(deposit_url)
+            job.author = clean_author(author_locator.inner_text())
+    except Exception as e:
+        raise StageFailed('Gathering Author', e)
 
-                # title
-                # there is only one h1 element so this is reliable
-                try:
-                    title_locator = page.locator('h1')
-                    title_locator.wait_for(timeout=10_000)
-                    title = title_locator.inner_text().strip()
+    # keywords
+    try:
+        with job.metrics.time('deposit_keywords'):
+            ul_locator = page.locator(KEYWORD_LIST).last
+            keywords_locator = ul_locator.locator('li')
+            keywords = [keywords_locator.nth(i).inner_text() for i in range(keywords_locator.count())]
+    except Exception as e:
+        raise StageFailed('Gathering Keywords', e)
+
+    # max amount is 50 keywords
+    job.keywords = clean_keywords(keywords)
+
+
+def scrape_deposit(page: Page, job: Job, scraper='browser'):
+    if scraper == 'http':
+        # one plain request, the browser is only needed when the page has to be rendered
+        try:
+            with job.metrics.time('deposit_fetch'):
+                info = fetch_deposit(job.deposit_id)
+        except Exception:
+            info = None
+
+        if info is not None and info.complete:
+            apply_deposit_info(job, info)
+            return
 
-                    if title.endswith(' — Photo'):
-                        title = title.removesuffix(' — Photo')
+    try:
+        with job.metrics.time('deposit_search'), get_limiter('deposit').slot() as slot:
+            response = page.goto(SEARCH_URL + job.deposit_id)
+            if response is not None:
+                slot.status(response.status, response.headers.get('retry-after'))
+    except Exception as e:
+        raise StageFailed('Searching Deposit Photos', e)
 
-                    elif title.endswith(' — Vector'):
-                        title = title.removesuffix(' — Vector')
+    job.deposit_url = page.url
 
-                    if title == 'Sorry, but we haven\'t found anything':
-                        print(f'Could not find photo ID {deposit_id} on Deposit Photos search')
-                        failed.writerow([filepath, deposit_id, 'Gathering Title', 'Photo doesn\'t exist on deposit photos'])
-                        continue
+    # title
+    # there is only one h1 element so this is reliable
+    try:
+        with job.metrics.time('deposit_title'):
+            title_locator = page.locator('h1')
+            title_locator.wait_for(timeout=10_000)
+            job.title = clean_title(title_locator.inner_text())
+    except Exception as e:
+        raise StageFailed('Gathering Title', e)
+
+    if job.title == NOT_FOUND_TITLE:
+        raise StageFailed('Gathering Title', 'Photo doesn\'t exist on deposit photos')
+
+    with job.metrics.time('load_lazy'):
+        load_lazy(page)
+
+    # the whole DOM in one round trip instead of one inner_text call per keyword
+    with job.metrics.time('deposit_parse'):
+        info = parse_deposit_html(page.content(), page.url)
+    if info.complete:
+        apply_deposit_info(job, info)
+        return
+
+    scrape_with_locators(page, job)
+
+
+def upload(job: Job, recorder: Recorder):
+    if not recorder.holds(job):
+        # stalled past the lease, another worker may be uploading the same image
+        raise StageFailed(LEASE_LOST, f'{recorder.options.shard} no longer holds the lease')
+
+    description = build_description(job.alt_text, job.deposit_url, job.author)
+    options = recorder.options
+
+    if options.upload_mode == 'chunked':
+        try:
+            job.piwigo_id = upload_file(
+                get_client(),
+                job.filepath,
+                {
+                    'categories': UPLOAD_CATEGORY,
+                    'name': job.title,
+                    'author': job.author,
+                    'comment': description,
+                },
+                tags=job.keywords,
+                state=recorder.state,
+                chunk_size=options.chunk_size,
+                workers=options.chunk_workers,
+                md5=job.md5,
+            )
+        except Exception as e:
+            raise StageFailed('Piwigo chunked upload', e)
+        return
 
-                    print(f'Title: {title}')
-                except Exception as e:
-                    failed.writerow([filepath, deposit_id, 'Gathering Title', str(e)])
-                    continue
+    try:
+        # new keywords become tags before the upload, so only ids go to Piwigo
+        recorder.tags.ensure(job.keywords)
+    except Exception as e:
+        raise StageFailed('Piwigo tags', e)
 
-                # author
-                try:
-                    author_locator = page.locator('._wdeBj')
-                    author_locator.wait_for(timeout=10_000)
+    try:
+        payload = {
+            'category': UPLOAD_CATEGORY,
+            'name': job.title,
+            'author': job.author,
+            'comment': description,
+        }
+
+        with open(job.filepath, 'rb') as f:
+            result = api_post(
+                'pwg.images.addSimple',
+                payload,
+                files={'image': f},
+                retry_timeouts=False,
+            )
+            job.piwigo_id = result['image_id']
+    except Exception as e:
+        raise StageFailed('Piwigo addSimple', e)
+
+    if job.keywords:
+        try:
+            recorder.tags.set_image_tags(job.piwigo_id, job.keywords)
+        except Exception as e:
+            # the image is up, failing the stage would upload it again
+            recorder.state.record_tag_failure(job.deposit_id, e)
+            recorder.log(f'ID {job.deposit_id}: could not set tags on {job.piwigo_id} ({e}), '
+                         f'python tags.py --failed sets them again')
+
+
+def prepare(filepath, recorder: Recorder):
+    # returns a job for files that still need processing, None otherwise
+    deposit_id = deposit_id_from_name(filepath.name)
+    if deposit_id is None:
+        return None
+
+    if not recorder.claim(deposit_id):
+        # finished or being worked on by another shard
+        recorder.progress.taken_elsewhere()
+        return None
+
+    job = Job(filepath, deposit_id, md5=recorder.hashes.get(filepath))
+    job.metrics = recorder.metrics.image(deposit_id)
+
+    if recorder.is_completed(deposit_id):
+        recorder.log(f'ID: {deposit_id}\nAlready completed\n')
+        return None
+
+    if not filepath.is_file():
+        recorder.log(f'ID {deposit_id}: {filepath} no longer exists')
+        recorder.fail(job, 'Reading file', 'File not found')
+        return None
+
+    row = recorder.state.get(deposit_id)
+    if row is not None:
+        job.restore(row, recorder.state.stage_status(deposit_id))
+
+    if 'alt_text' not in job.done:
+        backend = recorder.alt_text
+        job.md5 = job.md5 or file_md5(filepath)
+
+        # cached text, or a backend that runs ahead of the browser on its own workers
+        job.alt_text_pending = backend.submit(filepath, md5=job.md5)
+
+        if job.alt_text_pending is None:
+            if backend.max_bytes and os.path.getsize(filepath) >= backend.max_bytes:
+                if not recorder.downscaler.available:
+                    recorder.log(f'ID {deposit_id} is too large to generate alt text. Shrink file and run again')
+                    recorder.fail(job, 'Generating alt text', TOO_LARGE)
+                    return None
+                recorder.log(f'ID {deposit_id} is too large to generate alt text, shrinking a copy for it')
+
+            # starts encoding in the background, the browser stage waits on it
+            job.alt_text_source = recorder.downscaler.submit(filepath)
+
+    return job
+
+
+def skip_duplicates(candidates, recorder: Recorder) -> list[Path]:
+    # hash what's left to do and drop files whose bytes are already on Piwigo
+
+    hashes, duplicates, repeats = find_duplicates(
+        candidates, recorder.state, get_client(), recorder.options.hash_workers
+    )
+    recorder.hashes = hashes
 
-                    author = author_locator.inner_text().strip()
+    for filepath, piwigo_id in duplicates.items():
+        deposit_id = deposit_id_from_name(filepath.name)
+        recorder.log(f'ID {deposit_id} is already on Piwigo as {piwigo_id}, skipping')
+        recorder.state.record_duplicate(deposit_id, filepath, hashes[filepath], piwigo_id)
 
-                    if 'Photo by ' in author:
-                        _, _, author = author.partition('Photo by ')
-                    elif 'Vector by ' in author:
-                        _, _, author = author.partition('Vector by ')
+    for filepath, original in repeats.items():
+        recorder.log(f'{filepath.name} is the same file as {original.name}, skipping it this run')
 
-                    print(f'Author: {author}')
-                except Exception as e:
-                    failed.writerow([filepath, deposit_id, 'Gathering Author', str(e)])
-                    continue
+    return [f for f in candidates if f not in duplicates and f not in repeats]
 
-                # alt-text printing from before
-                print(f'Alt Text: {alt_text}')
 
-                # keywords
-                seen = set()
-                keywords = []
+def browser_stages(page: Page, job: Job, recorder: Recorder):
+    # runs the browser stages that haven't been checkpointed yet
+    if 'alt_text' not in job.done:
+        job.alt_text = generate_alt_text(page, job, recorder)
+        recorder.checkpoint(job, 'alt_text')
 
-                load_lazy(page)
+    if 'deposit' not in job.done:
+        scrape_deposit(page, job, recorder.options.scraper)
+        recorder.checkpoint(job, 'deposit')
 
-                try:
-                    ul_locator = page.locator('._U57rH').last
-                    keywords_locator = ul_locator.locator('li')
-                    num_keywords = keywords_locator.count()
-
-                    print('Keywords: ', end='')
-                    for i in range(num_keywords):
-                        li = keywords_locator.nth(i)
-                        keyword = li.inner_text().strip().lower()
-                        keywords.append(keyword)
-                        seen.add(keyword)
-                        print(keyword, end=', ')
-                    print()
-                except Exception as e:
-                    failed.writerow([filepath, deposit_id, 'Gathering Keywords', str(e)])
-                    continue
 
-                # max amount is 50 keywords
-                keywords = keywords[:50]
-                keywords_cell = ';'.join(keywords)
+def item_done(browser: BrowserSupervisor, recorder: Recorder):
+    # a recycle or restart that fails here is tried again by run() on the next image, which finds the page dead
+    try:
+        browser.item_done()
+    except Exception as e:
+        recorder.log(f'Could not renew the browser: {e}')
+
+
+def run_serial(files, recorder: Recorder):
+    # one page doing every stage in order, easiest to follow when debugging
+    with sync_playwright() as p:
+        browser = recorder.supervise(p)
+
+        for filepath in files:
+            job = prepare(filepath, recorder)
+            if job is None:
+                continue
+
+            recorder.log(f'ID: {job.deposit_id}')
+            if job.done:
+                recorder.log(f'Resuming after {", ".join(sorted(job.done))}')
+
+            try:
+                # a crashed or hung page is replaced and the image runs again from its last checkpoint
+                browser.run(lambda page: browser_stages(page, job, recorder))
+                recorder.log(job.deposit_url)
+                recorder.log(f'Title: {job.title}')
+                recorder.log(f'Author: {job.author}')
+                recorder.log(f'Alt Text: {job.alt_text}')
+                recorder.log(f'Keywords: {", ".join(job.keywords)}')
+
+                with job.metrics.time('upload'):
+                    upload(job, recorder)
+                recorder.log(f'Piwigo ID: {job.piwigo_id}')
+            except StageFailed as e:
+                recorder.log(f'ID {job.deposit_id} failed at {e.stage}: {e}')
+                recorder.fail(job, e.stage, str(e))
+                continue
+            except Exception as e:
+                # a browser that couldn't be restarted fails this image, the next one tries again
+                recorder.log(f'ID {job.deposit_id} failed: {e}')
+                recorder.fail(job, 'Serial run', str(e))
+                continue
+            finally:
+                item_done(browser, recorder)
+
+            recorder.complete(job)
+            recorder.log() # separate photos in terminal
+
+        browser.close()
+
+
+def browser_worker(jobs: queue.Queue, uploads: queue.Queue, recorder: Recorder):
+    # playwright's sync api is bound to the thread that started it,
+    # so every worker owns its own browser, context and page
+    try:
+        with sync_playwright() as p:
+            browser = recorder.supervise(p)
 
-                description = f"""
-Alt Text: {alt_text}
-Source URL: {deposit_url}
-Publisher: DepositPhotos
-Attribution: {author}/DepositPhotos
-"""
+            while True:
+                job = jobs.get()
+                if job is None:
+                    break
 
-                # Publish to Piwigo
                 try:
-                    tags = ','.join(keywords)
-                    payload = {
-                        'category': 3,
-                        'name': title,
-                        'author': author,
-                        'comment': description,
-                        'tags': tags,
-                    }
-
-                    with open(filepath, 'rb') as f:
-                        result = api_post(
-                            'pwg.images.addSimple',
-                            payload,
-                            files={'image': f},
-                        )
-                        piwigo_id = result['image_id']
-                        print(f'Piwigo ID: {piwigo_id}')
+                    browser.run(lambda page: browser_stages(page, job, recorder))
+                except StageFailed as e:
+                    recorder.log(f'ID {job.deposit_id} failed at {e.stage}: {e}')
+                    recorder.fail(job, e.stage, str(e))
+                    continue
                 except Exception as e:
-                    failed.writerow([filepath, deposit_id, 'Piwigo addSimple', str(e)])
-                    print(f'File {filepath} failed uploading: {str(e)}')
+                    # keep the worker alive so the queues keep draining
+                    recorder.fail(job, 'Browser worker', str(e))
                     continue
+                finally:
+                    item_done(browser, recorder)
 
-                print(f'{photo_count / total_photos * 100:.1f}% complete, {photo_count}/{total_photos}')
-
-                print() # separate photos in terminal
+                # blocks when the uploaders fall behind
+                uploads.put(job)
 
-                # success
-                completed_ids.add(deposit_id)
-                completed.writerow([filepath, deposit_id, deposit_url, title, author, alt_text, keywords_cell, piwigo_id])
+            browser.close()
+    except Exception as e:
+        # the browser itself is gone, fail what this worker would have taken so the run can still finish
+        recorder.log(f'Browser worker stopped: {e}')
+        while (job := jobs.get()) is not None:
+            recorder.fail(job, 'Browser worker', str(e))
+
+
+def upload_worker(uploads: queue.Queue, recorder: Recorder):
+    while True:
+        job = uploads.get()
+        if job is None:
+            break
+
+        try:
+            with job.metrics.time('upload'):
+                upload(job, recorder)
+        except StageFailed as e:
+            recorder.log(f'ID {job.deposit_id} failed at {e.stage}: {e}')
+            recorder.fail(job, e.stage, str(e))
+            continue
+        except Exception as e:
+            recorder.fail(job, 'Upload worker', str(e))
+            continue
+
+        try:
+            recorder.log(f'ID {job.deposit_id} -> Piwigo ID {job.piwigo_id}: {job.title}')
+            recorder.complete(job)
+        except Exception as e:
+            # keep the uploader alive, a dead one would leave the browser workers stuck on a full queue
+            recorder.log(f'ID {job.deposit_id}: could not record the upload of Piwigo ID {job.piwigo_id}: {e}')
+            recorder.fail(job, 'Upload worker', str(e))
+
+
+def run_pipelined(files, recorder: Recorder):
+    workers = recorder.options.workers
+    uploaders = recorder.options.uploaders
+
+    jobs = queue.Queue(maxsize=workers * 2)
+    uploads = queue.Queue(maxsize=uploaders * 2)
+
+    browsers = [threading.Thread(target=browser_worker, args=(jobs, uploads, recorder)) for _ in range(workers)]
+    uploading = [threading.Thread(target=upload_worker, args=(uploads, recorder)) for _ in range(uploaders)]
+    for t in browsers + uploading:
+        t.start()
 
-            if file_too_large:
-                print('One or more files was too large. Check the failed.tsv file to see which ones.')
-                print('https://compressjpeg.com/')
+    try:
+        for filepath in files:
+            job = prepare(filepath, recorder)
+            if job is None:
+                continue
+
+            if {'alt_text', 'deposit'} <= job.done:
+                # only the upload is left, no need to wait for a browser
+                uploads.put(job)
+            else:
+                jobs.put(job)
+    finally:
+        # even when prepare() raised, so the workers finish what they have and the run exits
+        for _ in browsers:
+            jobs.put(None)
+        for t in browsers:
+            t.join()
+
+        for _ in uploading:
+            uploads.put(None)
+        for t in uploading:
+            t.join()
+
+
+def main(directory=None, options: Options = None):
+    options = options or Options()
+    state = open_state()
+
+    if options.retry_failed:
+        # only the images still listed as failed, wherever they live
+        # one entry per file, two images sharing a path would otherwise be uploaded twice
+        files = list(dict.fromkeys(Path(f['local_path']) for f in state.failures() if f['local_path']))
+        skipped = 0
+    else:
+        # one pass over the folder, already completed ids drop out before the count
+        files = []
+        skipped = 0
+        for filepath, deposit_id in scan(directory, options.recursive):
+            if state.is_completed(deposit_id):
+                skipped += 1
+            else:
+                files.append(filepath)
+
+    run_id = options.run_id or time.strftime('%Y%m%d-%H%M%S')
+
+    completed_path = shard_path(COMPLETED, options.shard) if options.shard else COMPLETED
+    ensure_header(completed_path, COMPLETED_HEADER)
+    with open(completed_path, 'a', newline='', encoding='utf-8') as completed_tsv:
+        recorder = Recorder(completed_tsv, state, run_id, options)
+
+        if options.dedup:
+            before = len(files)
+            files = skip_duplicates(files, recorder)
+            skipped += before - len(files)
+
+        # images resumed after the Deposit Photos stage already know their keywords, their tags are made now
+        known = set()
+        for filepath in files:
+            row = state.get(deposit_id_from_name(filepath.name))
+            if row is not None:
+                known.update(split_keywords(row['keywords']))
+        recorder.tags.ensure(known)
+
+        print(f'{len(files)} images to transfer, {skipped} already done')
+        recorder.progress = Progress(len(files), skipped)
+
+        recorder.start_leases()
+        try:
+            # a sharded run ends with the images of shards that stopped halfway
+            files = itertools.chain(files, recorder.abandoned(files))
+            if options.workers <= 1:
+                run_serial(files, recorder)
+            else:
+                run_pipelined(files, recorder)
+        finally:
+            recorder.stop_leases()
+            recorder.downscaler.close()
+            recorder.alt_text.close()
+            if recorder.copyrights is not None:
+                recorder.copyrights.close()
+            recorder.progress.close()
+            recorder.metrics.close()
+            if options.shard:
+                # the other shards may still be failing and retrying images, state.py merge rebuilds failed.tsv
+                write_tsv(recorder.log_path(FAILED), FAILED_HEADER, recorder.failures)
+            else:
+                # failures live in state.db now, failed.tsv is rebuilt from it instead of truncated up front
+                state.export_failed(FAILED)
+
+        print(recorder.traffic.report())
+        print(recorder.browser_memory.report())
+        print('Request limits at the end of the run:')
+        print(limits_summary())
+        if options.metrics_path:
+            print(recorder.metrics.summary())
+            print(f'Per-image timings appended to {recorder.log_path(options.metrics_path)}')
+        if options.prometheus_path:
+            recorder.metrics.write_prometheus(options.prometheus_path)
+        print(f'Run ID: {run_id}')
+        if options.shard:
+            print(f'Once every worker has finished, python state.py merge writes {COMPLETED} and {FAILED}')
+        if recorder.file_too_large:
+            print('One or more files was too large. Check the failed.tsv file to see which ones.')
+            print('Install Pillow (pip install -r requirements.txt) to shrink them automatically, or use https://compressjpeg.com/')
 
-            browser.close()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Transfer Deposit Photos downloads to Piwigo')
+    parser.add_argument('directory', nargs='?', help='folder of Depositphotos_*_XL.jpg files (asks if omitted)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='browser pages generating alt text and scraping in parallel (1 = single page, for debugging)')
+    parser.add_argument('--uploaders', type=int, default=2, help='concurrent Piwigo uploads when --workers > 1')
+    parser.add_argument('--scraper', choices=['browser', 'http'], default='browser',
+                        help='http fetches Deposit Photos pages without rendering them, falling back to the browser')
+    parser.add_argument('--no-blocking', action='store_true',
+                        help='let the browser load images, fonts and trackers (blocked by default)')
+    parser.add_argument('--alt-text', choices=sorted(BACKENDS), default='tailwind',
+                        help='tailwind uses the web generator in the browser, local runs a captioning model on the cpu')
+    parser.add_argument('--alt-text-workers', type=int, default=None, help='processes for --alt-text local')
+    parser.add_argument('--alt-text-batch', type=int, default=8, help='images per model call for --alt-text local')
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument('--headless', action='store_true', default=None,
+                        help="don't open a browser window (the default when there is no display)")
+    window.add_argument('--headed', action='store_false', dest='headless', help='show the browser window')
+    parser.add_argument('--recycle-every', type=int, default=200,
+                        help='images per browser context before starting a fresh one (0 never)')
+    parser.add_argument('--max-browser-mb', type=int, default=1500,
+                        help="restart a worker's browser once it uses this much memory (0 no limit, needs psutil)")
+    parser.add_argument('--recursive', action='store_true', help='also look in subfolders of the directory')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='only reprocess images listed in failed.tsv, resuming at their failed stage')
+    parser.add_argument('--upload', choices=['simple', 'chunked'], default='simple',
+                        help='chunked streams the file in resumable pieces, better for large files on slow links')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='bytes per chunk for --upload chunked')
+    parser.add_argument('--chunk-workers', type=int, default=4, help='chunks sent in parallel per image')
+    parser.add_argument('--no-dedup', action='store_true', help="don't check file hashes against Piwigo before starting")
+    parser.add_argument('--hash-workers', type=int, default=8, help='files hashed in parallel for the duplicate check')
+    parser.add_argument('--shrink-workers', type=int, default=None,
+                        help='processes shrinking oversized images for alt text (default one per cpu)')
+    parser.add_argument('--metrics', default='metrics.jsonl', help='file the per-image stage timings are appended to')
+    parser.add_argument('--no-metrics', action='store_true', help="don't time the stages")
+    parser.add_argument('--prometheus', help='write the stage timings in Prometheus text format here at the end')
+    parser.add_argument('--shard', nargs='?', const=f'{socket.gethostname()}-{os.getpid()}',
+                        help='run as one of several workers sharing state.db, claiming images through leases '
+                             '(name defaults to host-pid)')
+    parser.add_argument('--lease', type=int, default=600,
+                        help='seconds before images claimed by a worker that stopped responding are claimed again')
+    parser.add_argument('--run-id', help='Run ID to record, give every shard the same one')
+    parser.add_argument('--copyright', action='store_true',
+                        help='set the copyright after each upload (needs USERNAME and PASSWORD in .env)')
+    args = parser.parse_args()
+
+    options = Options(
+        workers=args.workers,
+        uploaders=args.uploaders,
+        retry_failed=args.retry_failed,
+        recursive=args.recursive,
+        scraper=args.scraper,
+        block_requests=not args.no_blocking,
+        alt_text_backend=args.alt_text,
+        alt_text_workers=args.alt_text_workers,
+        alt_text_batch=args.alt_text_batch,
+        upload_mode=args.upload,
+        chunk_size=args.chunk_size,
+        chunk_workers=args.chunk_workers,
+        shrink_workers=args.shrink_workers,
+        dedup=not args.no_dedup,
+        hash_workers=args.hash_workers,
+        copyright=args.copyright,
+        headless=args.headless,
+        metrics_path=None if args.no_metrics else args.metrics,
+        prometheus_path=args.prometheus,
+        shard=args.shard,
+        lease_seconds=args.lease,
+        run_id=args.run_id,
+        recycle_every=args.recycle_every,
+        max_browser_mb=args.max_browser_mb,
+    )
+
+
+    if options.retry_failed:
+        main(options=options)
+    else:
+        directory_raw = args.directory or input('Directory: ').strip()
+        main(Path(directory_raw).expanduser().resolve(), options)
@@ -0,0 +1,282 @@
+# stage timings for main.py
+# every image gets one JSON line in metrics.jsonl when it finishes: seconds per stage, retries, bytes, outcome
+# running totals per stage go in the same file every AGGREGATE_EVERY images, and optionally to a Prometheus text file
+# a stage whose recent average drifts well above its run average is reported while the run is going,
+# that is usually a third-party site slowing down
+
+import json
+import threading
+import time
+
+from collections import deque
+
+
+AGGREGATE_EVERY = 50
+
+# recent samples per stage compared against the whole run
+WINDOW = 20
+SLOWDOWN = 2.0
+
+# histogram buckets in seconds for the Prometheus dump
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PREFIX = 'piwigo_transfer'
+
+
+class _Timer:
+    # a plain class, cheaper than contextlib on a path that runs several times per image
+    __slots__ = ('record', 'stage', 'start', 'outer')
+
+    def __init__(self, record, stage):
+        self.record = record
+        self.stage = stage
+
+    def __enter__(self):
+        # retried requests in this thread are counted against the image while the stage runs
+        active = self.record.metrics.active
+        self.outer = getattr(active, 'record', None)
+        active.record = self.record
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.record.add(self.stage, time.perf_counter() - self.start)
+        self.record.metrics.active.record = self.outer
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class ImageRecord:
+    def __init__(self, metrics: 'Metrics', deposit_id):
+        self.metrics = metrics
+        self.deposit_id = deposit_id
+        self.stages = {}
+        self.retries = 0
+        self.started = time.time()
+
+    def time(self, stage):
+        return _Timer(self, stage)
+
+    def add(self, stage, seconds):
+        # a stage that runs twice (a retried page load) adds up
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.metrics.observe(stage, seconds)
+
+    def finish(self, status, uploaded_bytes=0, failed_stage=None):
+        self.metrics.finish(self, status, uploaded_bytes, failed_stage)
+
+
+class _NullRecord:
+    def time(self, stage):
+        return _NULL_TIMER
+
+    def add(self, stage, seconds):
+        pass
+
+    def finish(self, status, uploaded_bytes=0, failed_stage=None):
+        pass
+
+
+NULL_RECORD = _NullRecord()
+
+
+class StageStats:
+    __slots__ = ('count', 'total', 'max', 'buckets', 'recent', 'warned')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.recent = deque(maxlen=WINDOW)
+        self.warned = False
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.recent.append(seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def recent_mean(self):
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    def slowing(self) -> bool:
+        # only once there is a run average worth comparing to
+        return self.count >= 2 * WINDOW and self.recent_mean > SLOWDOWN * self.mean
+
+
+class Metrics:
+    def __init__(self, path='metrics.jsonl', run_id=None, log=print):
+        self.path = path
+        self.run_id = run_id
+        self.log = log
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.images = {}
+        self.retries = {}
+        self.uploaded_bytes = 0
+        self.finished = 0
+        self.active = threading.local()
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+
+    def image(self, deposit_id) -> ImageRecord:
+        return ImageRecord(self, deposit_id)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.add(seconds)
+
+            if stats.slowing():
+                if not stats.warned:
+                    stats.warned = True
+                    self.log(f'{stage} is slowing down: last {WINDOW} took {stats.recent_mean:.2f}s on average, '
+                             f'{stats.mean:.2f}s over the run')
+            else:
+                stats.warned = False
+
+    def retry(self, what):
+        # called by PiwigoClient for every retried request
+        record = getattr(self.active, 'record', None)
+        if record is not None:
+            record.retries += 1
+        with self.lock:
+            self.retries[what] = self.retries.get(what, 0) + 1
+
+    def finish(self, record: ImageRecord, status, uploaded_bytes=0, failed_stage=None):
+        line = {
+            'type': 'image',
+            'run_id': self.run_id,
+            'deposit_id': record.deposit_id,
+            'status': status,
+            'failed_stage': failed_stage,
+            'seconds': round(time.time() - record.started, 3),
+            'stages': {stage: round(seconds, 4) for stage, seconds in record.stages.items()},
+            'retries': record.retries,
+            'bytes': uploaded_bytes,
+            'ended': round(time.time(), 3),
+        }
+
+        with self.lock:
+            self.images[status] = self.images.get(status, 0) + 1
+            self.uploaded_bytes += uploaded_bytes
+            self.finished += 1
+            if self.file is not None:
+                self.file.write(json.dumps(line) + '\n')
+                if self.finished % AGGREGATE_EVERY == 0:
+                    self._write_aggregate()
+                self.file.flush()
+
+    def _aggregate(self) -> dict:
+        return {
+            'type': 'aggregate',
+            'run_id': self.run_id,
+            'images': dict(self.images),
+            'bytes': self.uploaded_bytes,
+            'retries': dict(self.retries),
+            'stages': {
+                stage: {
+                    'count': stats.count,
+                    'mean': round(stats.mean, 4),
+                    'recent_mean': round(stats.recent_mean, 4),
+                    'max': round(stats.max, 4),
+                }
+                for stage, stats in self.stages.items()
+            },
+            'time': round(time.time(), 3),
+        }
+
+    def _write_aggregate(self):
+        self.file.write(json.dumps(self._aggregate()) + '\n')
+
+    def summary(self) -> str:
+        # where the time went, biggest stage first
+        with self.lock:
+            total = sum(stats.total for stats in self.stages.values()) or 1
+            parts = [
+                f'{stage} {stats.mean:.2f}s ({stats.total / total:.0%})'
+                for stage, stats in sorted(self.stages.items(), key=lambda item: -item[1].total)
+            ]
+            retries = sum(self.retries.values())
+        line = 'Average time per stage: ' + (', '.join(parts) or 'nothing timed')
+        if retries:
+            line += f', {retries} retried requests'
+        return line
+
+    def prometheus(self) -> str:
+        with self.lock:
+            lines = [
+                f'# TYPE {PREFIX}_stage_seconds histogram',
+            ]
+            for stage, stats in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {stats.count}')
+
+            lines.append(f'# TYPE {PREFIX}_images_total counter')
+            for status, count in sorted(self.images.items()):
+                lines.append(f'{PREFIX}_images_total{{status="{status}"}} {count}')
+
+            lines.append(f'# TYPE {PREFIX}_retries_total counter')
+            for what, count in sorted(self.retries.items()):
+                lines.append(f'{PREFIX}_retries_total{{request="{what}"}} {count}')
+
+            lines.append(f'# TYPE {PREFIX}_uploaded_bytes_total counter')
+            lines.append(f'{PREFIX}_uploaded_bytes_total {self.uploaded_bytes}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._write_aggregate()
+                self.file.close()
+                self.file = None
+
+
+class NullMetrics:
+    # --no-metrics, every call is a no-op
+    def image(self, deposit_id):
+        return NULL_RECORD
+
+    def retry(self, what):
+        pass
+
+    def summary(self):
+        return ''
+
+    def write_prometheus(self, path):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,366 @@
+# local stand-in for Piwigo's ws.php, the batch manager, the Tailwind generator and Deposit Photos pages
+# used by benchmark.py, and handy by hand: python mock_server.py --port 8000, then in .env
+#   PIWIGO_ROOT=http://127.0.0.1:8000/
+#   TAILWIND_URL=http://127.0.0.1:8000/tailwind
+#   DEPOSIT_SEARCH_URL=http://127.0.0.1:8000/search/
+# every request waits around --latency seconds and fails with a 503 at --error-rate, to see how the tools cope
+
+import argparse
+import email
+import email.policy
+import hashlib
+import html
+import json
+import random
+import threading
+import time
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+TOKEN = 'mock-pwg-token'
+KEYWORDS = 15
+
+TAILWIND_PAGE = '''<!doctype html>
+<html><body>
+<input type="file">
+<script>
+document.querySelector('input').addEventListener('change', (e) => {
+    setTimeout(() => {
+        const area = document.createElement('textarea');
+        area.value = 'A benchmark photo named ' + e.target.files[0].name + '.';
+        document.body.appendChild(area);
+    }, %d);
+});
+</script>
+</body></html>
+'''
+
+# the batch manager answers with its page, a box of infos or errors says how the action went
+ADMIN_PAGE = '''<!doctype html>
+<html><body>
+<div class="%s"><ul><li>%s</li></ul></div>
+</body></html>
+'''
+
+DEPOSIT_PAGE = '''<!doctype html>
+<html><body>
+<h1>Benchmark photo %(id)s — Photo</h1>
+<a class="_wdeBj" href="#">Photo by Bench Author %(author)s</a>
+<ul class="_U57rH">%(keywords)s</ul>
+</body></html>
+'''
+
+
+class Fail(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class MockPiwigo:
+    # in memory gallery, thread safe, shared by every request handler
+    def __init__(self, latency=0.0, error_rate=0.0, alt_text_delay=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.alt_text_delay = alt_text_delay
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.images = {}
+        self.md5s = {}
+        self.tags = {}
+        self.chunks = Counter()
+        self.next_id = 1
+        self.requests = Counter()
+
+    # injected trouble
+
+    def delay(self):
+        if self.latency:
+            with self.lock:
+                wait = self.latency * self.random.uniform(0.5, 1.5)
+            time.sleep(wait)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    # gallery
+
+    def add_image(self, name='', comment='', author='', category='3', tags=(), md5=None, filename='') -> int:
+        with self.lock:
+            image_id = self.next_id
+            self.next_id += 1
+            now = time.strftime('%Y-%m-%d %H:%M:%S')
+            self.images[image_id] = {
+                'id': image_id,
+                'name': name,
+                'comment': comment,
+                'author': author,
+                'file': filename,
+                'date_available': now,
+                'lastmodified': now,
+                'categories': [{'id': int(category)}] if category else [],
+                'tags': [t for t in tags if t],
+            }
+            if md5:
+                self.md5s[md5] = image_id
+            return image_id
+
+    def _image(self, image_id) -> dict:
+        image = self.images.get(int(image_id))
+        if image is None:
+            raise Fail(1004, 'image_id not found')
+        return image
+
+    def _tag_id(self, name) -> int:
+        if name not in self.tags:
+            self.tags[name] = len(self.tags) + 1
+        return self.tags[name]
+
+    def _page(self, images, params):
+        per_page = int(params.get('per_page', 100))
+        page = int(params.get('page', 0))
+        images = sorted(images, key=lambda i: i['id'])
+        return {'images': images[page * per_page:(page + 1) * per_page]}
+
+    def _check_token(self, params):
+        if params.get('pwg_token') != TOKEN:
+            raise Fail(403, 'Invalid security token')
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] += 1
+
+    def ws(self, method, params, files):
+        self.count(method)
+        handler = getattr(self, 'ws_' + method.replace('.', '_'), None)
+        if handler is None:
+            raise Fail(501, 'Method name is not valid')
+        return handler(params, files)
+
+    def ws_pwg_session_getStatus(self, params, files):
+        return {'username': 'bench', 'status': 'webmaster', 'pwg_token': TOKEN}
+
+    def ws_pwg_session_login(self, params, files):
+        return True
+
+    def ws_pwg_images_addSimple(self, params, files):
+        data = files.get('image', b'')
+        return {'image_id': self.add_image(
+            params.get('name', ''), params.get('comment', ''), params.get('author', ''), params.get('category', ''),
+            params.get('tags', '').split(','), hashlib.md5(data).hexdigest(), files.get('image_name', ''),
+        )}
+
+    def ws_pwg_images_addChunk(self, params, files):
+        with self.lock:
+            self.chunks[params['original_sum']] += 1
+
+    def ws_pwg_images_add(self, params, files):
+        md5 = params['original_sum']
+        with self.lock:
+            if not self.chunks.pop(md5, 0):
+                raise Fail(500, 'No chunks received')
+            tags = [name for name, tag_id in self.tags.items() if str(tag_id) in params.get('tag_ids', '').split(',')]
+        return {'image_id': self.add_image(
+            params.get('name', ''), params.get('comment', ''), params.get('author', ''), params.get('categories', ''),
+            tags, md5, params.get('original_filename', ''),
+        )}
+
+    def ws_pwg_images_exist(self, params, files):
+        with self.lock:
+            return {md5: self.md5s.get(md5) for md5 in params.get('md5sum_list', '').split(',') if md5}
+
+    def ws_pwg_images_getInfo(self, params, files):
+        with self.lock:
+            return dict(self._image(params['image_id']))
+
+    def ws_pwg_images_setInfo(self, params, files):
+        with self.lock:
+            image = self._image(params['image_id'])
+            for field in ('name', 'comment', 'author'):
+                if field in params:
+                    image[field] = params[field]
+            if 'tag_ids' in params:
+                ids = params['tag_ids'].split(',')
+                tags = [name for name, tag_id in self.tags.items() if str(tag_id) in ids]
+                image['tags'] = tags if params.get('multiple_value_mode') == 'replace' else image['tags'] + tags
+            image['lastmodified'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def ws_pwg_images_delete(self, params, files):
+        self._check_token(params)
+        with self.lock:
+            ids = [int(i) for i in params.get('image_id', '').replace(',', ';').split(';') if i.strip()]
+            deleted = [i for i in ids if self.images.pop(i, None) is not None]
+            for md5, image_id in list(self.md5s.items()):
+                if image_id in deleted:
+                    del self.md5s[md5]
+            return len(deleted)
+
+    def ws_pwg_categories_getImages(self, params, files):
+        category = int(params.get('cat_id', 0))
+        with self.lock:
+            images = [i for i in self.images.values() if {'id': category} in i['categories']]
+            return self._page(images, params)
+
+    def ws_pwg_tags_getAdminList(self, params, files):
+        with self.lock:
+            return {'tags': [{'id': tag_id, 'name': name} for name, tag_id in self.tags.items()]}
+
+    def ws_pwg_tags_add(self, params, files):
+        self._check_token(params)
+        with self.lock:
+            return {'id': self._tag_id(params['name'])}
+
+    def ws_pwg_tags_getImages(self, params, files):
+        with self.lock:
+            names = {name for name, tag_id in self.tags.items()
+                     if params.get('tag_name') == name or params.get('tag_id') == str(tag_id)}
+            if 'tag_name' in params:
+                names.add(params['tag_name'])
+            images = [i for i in self.images.values() if names & set(i['tags'])]
+            return self._page(images, params)
+
+    def batch_manager(self, fields):
+        # the Copyrights plugin action, the only batch manager form the tools post
+        self.count('admin.batch_manager')
+        if fields.get('pwg_token', [''])[0] != TOKEN:
+            raise Fail(403, 'Invalid security token')
+        with self.lock:
+            for image_id in fields.get('selection[]', []):
+                image = self.images.get(int(image_id))
+                if image is not None:
+                    image['copyright'] = fields.get('copyrightID', [''])[0]
+
+    # static pages
+
+    def deposit_page(self, deposit_id):
+        self.count('deposit.page')
+        keywords = ''.join(f'<li>keyword {n}</li>' for n in range(KEYWORDS))
+        return DEPOSIT_PAGE % {'id': html.escape(deposit_id), 'author': sum(map(ord, deposit_id)) % 7, 'keywords': keywords}
+
+    def tailwind_page(self):
+        self.count('tailwind.page')
+        return TAILWIND_PAGE % int(self.alt_text_delay * 1000)
+
+
+def _parse_multipart(content_type, body):
+    message = email.message_from_bytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body, policy=email.policy.HTTP
+    )
+    params, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True) or b''
+        if part.get_filename():
+            files[name] = payload
+            files[name + '_name'] = part.get_filename()
+        else:
+            params[name] = payload.decode('utf-8')
+    return params, files
+
+
+def make_handler(gallery: MockPiwigo):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/json', headers=()):
+            body = body.encode('utf-8') if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _trouble(self) -> bool:
+            gallery.delay()
+            if gallery.should_fail():
+                self._send(503, 'Service Unavailable (injected)', 'text/plain')
+                return True
+            return False
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if self._trouble():
+                return
+
+            if path.startswith('/search/'):
+                self._send(200, gallery.deposit_page(path.removeprefix('/search/')), 'text/html')
+            elif path == '/tailwind':
+                self._send(200, gallery.tailwind_page(), 'text/html')
+            else:
+                self._send(200, '<html><body>mock piwigo</body></html>', 'text/html')
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            content_type = self.headers.get('Content-Type', '')
+            path = urlsplit(self.path).path
+            if self._trouble():
+                return
+
+            if path.endswith('admin.php'):
+                try:
+                    gallery.batch_manager(parse_qs(body.decode('utf-8')))
+                except Fail as e:
+                    self._send(200, ADMIN_PAGE % ('errors', html.escape(str(e))), 'text/html')
+                    return
+                self._send(200, ADMIN_PAGE % ('infos', 'Information data registered in database'), 'text/html')
+                return
+
+            if content_type.startswith('multipart/form-data'):
+                params, files = _parse_multipart(content_type, body)
+            else:
+                params = {k: v[-1] for k, v in parse_qs(body.decode('utf-8')).items()}
+                files = {}
+
+            try:
+                result = {'stat': 'ok', 'result': gallery.ws(params.get('method', ''), params, files)}
+            except Fail as e:
+                result = {'stat': 'fail', 'err': e.code, 'message': str(e)}
+
+            headers = [('Set-Cookie', 'pwg_id=mock; Path=/')] if params.get('method') == 'pwg.session.login' else []
+            self._send(200, json.dumps(result), headers=headers)
+
+    return Handler
+
+
+def serve(gallery: MockPiwigo, host='127.0.0.1', port=0) -> ThreadingHTTPServer:
+    # runs in a daemon thread, server.server_port has the port when 0 was asked for
+    server = ThreadingHTTPServer((host, port), make_handler(gallery))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def env_for(server: ThreadingHTTPServer) -> dict[str, str]:
+    root = f'http://{server.server_address[0]}:{server.server_port}/'
+    return {
+        'PIWIGO_ROOT': root,
+        'TAILWIND_URL': root + 'tailwind',
+        'DEPOSIT_SEARCH_URL': root + 'search/',
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local Piwigo / Tailwind / Deposit Photos stand-in')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='average seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--alt-text-delay', type=float, default=0.0, help='seconds the fake generator takes')
+    args = parser.parse_args()
+
+    server = serve(MockPiwigo(args.latency, args.error_rate, args.alt_text_delay), port=args.port)
+    for name, value in env_for(server).items():
+        print(f'{name}={value}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
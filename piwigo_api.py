@@ -0,0 +1,246 @@
+# shared Piwigo web API client
+# every script goes through one pooled keep-alive session instead of a fresh connection per call
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import requests
+
+from dotenv import load_dotenv
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from ratelimit import get_limiter
+
+
+load_dotenv()
+# PIWIGO_ROOT in .env points every script at another gallery, e.g. the benchmark's local stand-in
+PIWIGO_ROOT = os.getenv('PIWIGO_ROOT', 'https://mines.piwigo.com/')
+PIWIGO_URL = PIWIGO_ROOT + 'ws.php?format=json'
+
+# cookies of logged in sessions, in Playwright's storage state format so the browser scripts share it
+STORAGE_STATE = Path('storage_state.json')
+
+# worth retrying, the request never got a proper answer
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# turned away before doing anything, the only answers worth retrying for calls that must not run twice
+REFUSED_STATUSES = {429, 503}
+
+
+def _not_sent(e: requests.ConnectionError) -> bool:
+    # no connection was made, so Piwigo can't have seen the request
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+_storage_lock = threading.Lock()
+
+
+def _cookie_key(cookie):
+    return cookie['name'], cookie['domain'].lstrip('.'), cookie['path']
+
+
+def write_storage_state(cookies, origins=None, path=STORAGE_STATE):
+    # storage_state.json is shared by the API session and the browser (browser.save_storage_state),
+    # each writer replaces the cookies it has and keeps the rest, origins=None keeps the saved local storage
+    path = Path(path)
+    with _storage_lock:
+        try:
+            saved = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            saved = {}
+
+        keys = {_cookie_key(c) for c in cookies}
+        state = {
+            'cookies': [c for c in saved.get('cookies', []) if _cookie_key(c) not in keys] + list(cookies),
+            'origins': saved.get('origins', []) if origins is None else origins,
+        }
+
+        tmp = Path(str(path) + '.tmp')
+        tmp.write_text(json.dumps(state, indent=2), encoding='utf-8')
+        os.replace(tmp, path)
+
+
+class PiwigoError(RuntimeError):
+    pass
+
+
+class PiwigoClient:
+    def __init__(self, api_key, url=PIWIGO_URL, pool_size=16, timeout=30, retries=3, backoff=1.0, max_backoff=30.0):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers.update({'X-PIWIGO-API': api_key})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token = None
+        self._token_lock = threading.Lock()
+        # called with the method name before every retry, main.py counts them in metrics.py
+        self.on_retry = None
+        # shared by every client in the process, see ratelimit.py
+        self.limiter = get_limiter('piwigo')
+
+    def _sleep(self, attempt, what):
+        if self.on_retry is not None:
+            self.on_retry(what)
+        # exponential backoff with full jitter
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def post(self, method: str, data: dict = None, files=None, retry_timeouts=True):
+        # retry_timeouts=False for calls that must not run twice (a timed out or 504ed upload may have landed)
+        payload = {'method': method, **(data or {})}
+        r = self.send(self.url, payload, files, retry_timeouts, what=method)
+        return self._result(method, r)
+
+    def send(self, url, data, files=None, retry_timeouts=True, what='request'):
+        # the raw response, with the same retries as post(), for pages outside ws.php
+        # retry_timeouts=False only resends when the request surely didn't run: refused connections, 429 and 503
+        retry_statuses = RETRY_STATUSES if retry_timeouts else REFUSED_STATUSES
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+
+            if files:
+                for f in files.values():
+                    if hasattr(f, 'seek'):
+                        f.seek(0)
+
+            try:
+                # waits while Piwigo is paused, and tells the limiter how the request went
+                with self.limiter.slot() as slot:
+                    r = self.session.post(url, data=data, files=files, timeout=self.timeout)
+                    slot.status(r.status_code, r.headers.get('Retry-After'))
+            except requests.ConnectionError as e:
+                if last or not (retry_timeouts or _not_sent(e)):
+                    raise PiwigoError(f'{what} could not reach Piwigo: {e}')
+                self._sleep(attempt, what)
+                continue
+            except requests.Timeout as e:
+                if last or not retry_timeouts:
+                    raise PiwigoError(f'{what} timed out: {e}')
+                self._sleep(attempt, what)
+                continue
+            except requests.RequestException as e:
+                # a broken or unreadable response, callers only expect PiwigoError
+                raise PiwigoError(f'{what} failed: {e}')
+
+            if r.status_code in retry_statuses and not last:
+                self._sleep(attempt, what)
+                continue
+
+            return r
+
+    @staticmethod
+    def _result(method, r):
+        text = r.text or ''
+        if r.status_code != 200:
+            raise PiwigoError(f'HTTP {r.status_code} from Piwigo: {text[:300]}')
+
+        try:
+            js = r.json()
+        except Exception:
+            raise PiwigoError(f'Non-JSON response from Piwigo: {text[:300]}')
+
+        if js.get('stat') == 'fail':
+            raise PiwigoError(f"{method} failed: {js.get('err')} {js.get('message')}")
+
+        return js.get('result')
+
+    def login(self, username, password):
+        # cookie session for admin pages the web API doesn't cover, such as the batch manager
+        self.post('pwg.session.login', {'username': username, 'password': password}, retry_timeouts=False)
+        with self._token_lock:
+            # the token belongs to the session, the one from before login is no good
+            self._token = None
+
+    def load_cookies(self, path=STORAGE_STATE):
+        try:
+            saved = json.loads(Path(path).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return
+        for cookie in saved.get('cookies', []):
+            self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+
+    def save_cookies(self, path=STORAGE_STATE):
+        # replaces the cookies this session has, keeps whatever else the browser saved
+        write_storage_state([
+            {
+                'name': c.name,
+                'value': c.value,
+                'domain': c.domain,
+                'path': c.path,
+                'expires': c.expires or -1,
+                'httpOnly': False,
+                'secure': c.secure,
+                'sameSite': 'Lax',
+            }
+            for c in self.session.cookies
+        ], path=path)
+
+    def ensure_login(self, username, password, path=STORAGE_STATE):
+        # reuses the saved session and only logs in again once Piwigo has expired it
+        self.load_cookies(path)
+        if (self.post('pwg.session.getStatus') or {}).get('status') not in (None, 'guest'):
+            return
+        self.login(username, password)
+        self.save_cookies(path)
+
+    def pwg_token(self):
+        # needed by write methods such as pwg.images.delete, one lookup per client
+        with self._token_lock:
+            if self._token is None:
+                self._token = self.post('pwg.session.getStatus')['pwg_token']
+            return self._token
+
+
+class AsyncPiwigoClient:
+    # asyncio front end for async callers, calls run on the pooled session in worker threads
+    # with the same retries and PiwigoError on stat == 'fail' as PiwigoClient.post
+    def __init__(self, client: PiwigoClient = None, concurrency=8):
+        self.client = client or get_client()
+        # requests in flight, on top of the per-site limiter every PiwigoClient call goes through
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(self, method: str, data: dict = None, files=None, retry_timeouts=True):
+        async with self.semaphore:
+            return await asyncio.to_thread(self.client.post, method, data, files, retry_timeouts)
+
+    async def gather(self, method: str, payloads, return_exceptions=False):
+        # results come back in the same order as payloads
+        return await asyncio.gather(
+            *(self.post(method, data) for data in payloads),
+            return_exceptions=return_exceptions,
+        )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> PiwigoClient:
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            api_key = os.getenv('API_KEY')
+            if not api_key:
+                raise RuntimeError('API Key not found')
+            _client = PiwigoClient(api_key)
+        return _client
+
+
+def api_post(method: str, data: dict = None, files=None, retry_timeouts=True):
+    return get_client().post(method, data, files, retry_timeouts)
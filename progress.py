@@ -0,0 +1,94 @@
+# progress bar for main.py with per-stage rates and an ETA
+# uses tqdm when it's installed and falls back to the old "% complete" lines otherwise
+
+import threading
+import time
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+
+class Progress:
+    def __init__(self, total, skipped=0):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.uploaded_bytes = 0
+        self.stage_counts = {}
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.bar = None
+        if tqdm is not None and total > 0:
+            self.bar = tqdm(total=total, desc='Transferring', unit='img', dynamic_ncols=True)
+
+    def write(self, message):
+        # print without tearing the bar
+        if self.bar is not None:
+            self.bar.write(message)
+        else:
+            print(message)
+
+    def stage_done(self, stage):
+        with self.lock:
+            self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+            self._refresh()
+
+    def finished(self, uploaded_bytes=0, failed=False):
+        with self.lock:
+            self.done += 1
+            self.uploaded_bytes += uploaded_bytes
+            if failed:
+                self.failed += 1
+
+            if self.bar is not None:
+                self.bar.update(1)
+                self._refresh()
+            else:
+                print(f'{self.done / max(self.total, 1) * 100:.1f}% complete, {self.done}/{self.total}{self._eta()}')
+
+    def taken_elsewhere(self):
+        # a sharded run where another worker claimed the image first, it no longer counts here
+        with self.lock:
+            self.total -= 1
+            if self.bar is not None:
+                self.bar.total = self.total
+                self.bar.refresh()
+
+    def taken_back(self):
+        # an image another worker claimed and never finished, this one does it after all
+        with self.lock:
+            self.total += 1
+            if self.bar is not None:
+                self.bar.total = self.total
+                self.bar.refresh()
+
+    def _rates(self) -> str:
+        minutes = max(time.monotonic() - self.start, 1e-6) / 60
+        parts = [f'{name} {count / minutes:.1f}/min' for name, count in self.stage_counts.items()]
+        parts.append(f'{self.uploaded_bytes / 1e6 / (minutes * 60):.2f} MB/s')
+        if self.failed:
+            parts.append(f'{self.failed} failed')
+        return ', '.join(parts)
+
+    def _eta(self) -> str:
+        elapsed = time.monotonic() - self.start
+        if not self.done or self.done >= self.total:
+            return ''
+        remaining = elapsed / self.done * (self.total - self.done)
+        return f', ETA {time.strftime("%H:%M:%S", time.gmtime(remaining))}'
+
+    def _refresh(self):
+        if self.bar is not None:
+            self.bar.set_postfix_str(self._rates(), refresh=False)
+
+    def close(self):
+        if self.bar is not None:
+            self.bar.close()
+
+        elapsed = time.monotonic() - self.start
+        print(f'{self.done}/{self.total} images in {time.strftime("%H:%M:%S", time.gmtime(elapsed))} '
+              f'({self.skipped} already done), {self._rates()}')
@@ -0,0 +1,259 @@
+# pacing for tools that fire many Piwigo calls at once
+# AdaptiveLimiter paces one site (piwigo, tailwind, deposit) for every thread in the process:
+# rate and parallel requests start at their ceiling, halve on 429/5xx and errors and creep back up on success,
+# and after FAILURES failures in a row the site is paused for a cooldown instead of failing image after image
+# ceilings can be changed in .env, e.g. LIMIT_TAILWIND=max_rate=1,concurrency=2
+
+import os
+import threading
+import time
+
+from dataclasses import dataclass, fields
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+class TokenBucket:
+    # allows `rate` calls per second on average and bursts of up to `burst`, shared by threads
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate or self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# answers that mean the site wants us to slow down, other 5xx count as plain errors
+THROTTLE_STATUSES = {429, 503}
+
+
+@dataclass
+class HostLimits:
+    # requests per second and requests in flight, where the limiter starts and what it climbs back to
+    max_rate: float
+    concurrency: int
+    # never slower than this, however badly the site behaves
+    min_rate: float = 0.1
+    # a successful request slower than this still eases off a little, 0 to ignore latency (uploads are slow anyway)
+    target_latency: float = 0.0
+    # failures in a row that pause the site, and the first pause in seconds (doubles while it keeps failing)
+    failures: int = 5
+    cooldown: float = 30.0
+    max_cooldown: float = 600.0
+
+    @classmethod
+    def from_env(cls, name, default: 'HostLimits') -> 'HostLimits':
+        # LIMIT_<NAME>=key=value,key=value
+        values = {f.name: getattr(default, f.name) for f in fields(cls)}
+        # the declared type, a default written as 20 would otherwise turn max_rate=0.5 into int('0.5')
+        kinds = {f.name: f.type for f in fields(cls)}
+        for item in os.getenv(f'LIMIT_{name.upper()}', '').split(','):
+            key, _, value = item.partition('=')
+            key = key.strip()
+            if key in values and value.strip():
+                try:
+                    values[key] = kinds[key](value.strip())
+                except ValueError:
+                    raise ValueError(
+                        f'LIMIT_{name.upper()}: {key} needs a {kinds[key].__name__}, got {value.strip()!r}'
+                    )
+        return cls(**values)
+
+
+HOSTS = {
+    'piwigo': HostLimits(max_rate=20.0, concurrency=16),
+    'tailwind': HostLimits(max_rate=2.0, concurrency=8, target_latency=30.0),
+    'deposit': HostLimits(max_rate=3.0, concurrency=8, target_latency=15.0),
+}
+
+
+def _retry_after(value) -> float | None:
+    # only the seconds form, the date form is rare enough to fall back to the cooldown
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Slot:
+    __slots__ = ('limiter', 'start', 'outcome', 'retry_after')
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.outcome = None
+        self.retry_after = None
+
+    def status(self, code, retry_after=None):
+        # HTTP status of the response, for requests that don't raise on errors
+        if code in THROTTLE_STATUSES:
+            self.outcome = 'throttled'
+            self.retry_after = _retry_after(retry_after)
+        elif code is not None and code >= 500:
+            self.outcome = 'error'
+
+    def __enter__(self):
+        self.limiter.enter()
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = self.outcome or ('error' if exc_type is not None else 'ok')
+        self.limiter.exit(outcome, time.monotonic() - self.start, self.retry_after)
+        return False
+
+
+class AdaptiveLimiter:
+    def __init__(self, name, limits: HostLimits):
+        self.name = name
+        self.limits = limits
+        self.rate = limits.max_rate
+        self.concurrency = float(limits.concurrency)
+        self.bucket = TokenBucket(self.rate)
+        self.cond = threading.Condition()
+        self.active = 0
+
+        # breaker: closed lets everything through, open pauses the site, half_open lets one request test it
+        self.state = 'closed'
+        self.open_until = 0.0
+        self.cooldown = limits.cooldown
+        self.probing = False
+        self.failed_in_row = 0
+
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.lowest_rate = self.rate
+
+    def slot(self) -> _Slot:
+        return _Slot(self)
+
+    def enter(self):
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.state == 'open':
+                    if now < self.open_until:
+                        self.cond.wait(self.open_until - now)
+                        continue
+                    self.state = 'half_open'
+                    self.probing = False
+
+                if self.state == 'half_open':
+                    if not self.probing:
+                        self.probing = True
+                        break
+                elif self.active < max(1, int(self.concurrency)):
+                    break
+                self.cond.wait(1.0)
+
+            self.active += 1
+            self.requests += 1
+        self.bucket.acquire()
+
+    def exit(self, outcome, seconds, retry_after=None):
+        limits = self.limits
+        with self.cond:
+            self.active -= 1
+
+            if outcome == 'ok':
+                self.failed_in_row = 0
+                if self.state == 'half_open':
+                    self.state = 'closed'
+                    self.cooldown = limits.cooldown
+                    _log(f'{self.name} is answering again, resuming')
+
+                if limits.target_latency and seconds > limits.target_latency:
+                    self._decrease(0.9)
+                else:
+                    # additive increase, a full recovery takes about 50 good requests
+                    self.rate = min(limits.max_rate, self.rate + limits.max_rate / 50)
+                    self.concurrency = min(limits.concurrency, self.concurrency + 1 / max(1.0, self.concurrency))
+            else:
+                if outcome == 'throttled':
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                self.failed_in_row += 1
+                self._decrease(0.5)
+
+                if self.state == 'half_open' or self.failed_in_row >= limits.failures or retry_after:
+                    self._open(retry_after)
+
+            self.bucket.rate = self.rate
+            self.bucket.burst = max(1, int(self.rate))
+            self.cond.notify_all()
+
+    def _decrease(self, factor):
+        self.rate = max(self.limits.min_rate, self.rate * factor)
+        self.concurrency = max(1.0, self.concurrency * factor)
+        self.lowest_rate = min(self.lowest_rate, self.rate)
+
+    def _open(self, retry_after=None):
+        if self.state == 'open':
+            return
+        wait = max(self.cooldown, retry_after or 0)
+        self.state = 'open'
+        self.probing = False
+        self.open_until = time.monotonic() + wait
+        self.pauses += 1
+        self.paused_seconds += wait
+        self.cooldown = min(self.limits.max_cooldown, self.cooldown * 2)
+        _log(f'{self.name} failed {self.failed_in_row} times in a row, pausing it for {wait:.0f}s')
+
+    def summary(self) -> str:
+        with self.cond:
+            line = (
+                f'{self.name}: {self.rate:.1f}/{self.limits.max_rate:g} req/s (lowest {self.lowest_rate:.1f}), '
+                f'{int(self.concurrency)}/{self.limits.concurrency} parallel, {self.requests} requests'
+            )
+            if self.throttled or self.errors:
+                line += f', {self.throttled} throttled, {self.errors} errors'
+            if self.pauses:
+                line += f', paused {self.pauses} times for {self.paused_seconds:.0f}s'
+        return line
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_log = print
+
+
+def get_limiter(name) -> AdaptiveLimiter:
+    # one per site for the whole process, every client and browser worker shares it
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = AdaptiveLimiter(name, HostLimits.from_env(name, HOSTS[name]))
+        return limiter
+
+
+def set_log(log):
+    # main.py prints pauses above its progress bar
+    global _log
+    _log = log
+
+
+def summary() -> str:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return '\n'.join(limiter.summary() for limiter in limiters)
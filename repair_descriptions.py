@@ -0,0 +1,122 @@
+# pushes rebuilt descriptions for the images description_audit.py flagged
+# the description comes from the alt text, source URL and author in state.db, in the same template main.py uploads
+# --dry-run prints a diff against what Piwigo has now and changes nothing
+# every ID gets a row in repair_descriptions.tsv saying what happened to it
+
+import argparse
+import csv
+import difflib
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from description import build_description
+from piwigo_api import PiwigoClient, get_client
+from ratelimit import TokenBucket
+from state import StateStore, open_state, read_tsv
+
+
+AUDIT_REPORT = 'description_pattern_audit.tsv'
+RESULT_LOG = 'repair_descriptions.tsv'
+FIXABLE = ('MISSING_DESCRIPTION', 'MISSING_CUSTOM_DESCRIPTION')
+
+
+def flagged_ids(report=AUDIT_REPORT, statuses=FIXABLE) -> list[str]:
+    # PiwigoID, Title, DescriptionHasAltText, Status
+    return [row[0].strip() for row in read_tsv(report) if len(row) >= 4 and row[3] in statuses]
+
+
+def rebuilt_description(state: StateStore, image_id) -> tuple[str | None, str]:
+    # (description, reason it couldn't be rebuilt)
+    row = state.by_piwigo_id(image_id)
+    if row is None:
+        return None, 'not in state.db'
+    if not row['alt_text']:
+        return None, 'no alt text stored'
+    return build_description(row['alt_text'], row['source_url'], row['author']), ''
+
+
+def diff(image_id, old, new) -> str:
+    return ''.join(difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True),
+        fromfile=f'{image_id} on Piwigo', tofile=f'{image_id} rebuilt',
+    ))
+
+
+def repair(client: PiwigoClient, state: StateStore, limiter: TokenBucket, image_id, dry_run=False) -> list[str]:
+    # returns the result log row
+    description, reason = rebuilt_description(state, image_id)
+    if description is None:
+        return [image_id, 'SKIPPED', reason]
+
+    try:
+        if dry_run:
+            limiter.acquire()
+            info = client.post('pwg.images.getInfo', {'image_id': image_id}) or {}
+            return [image_id, 'DRY_RUN', diff(image_id, str(info.get('comment') or ''), description)]
+
+        limiter.acquire()
+        client.post('pwg.images.setInfo', {
+            'image_id': image_id,
+            'comment': description,
+            'single_value_mode': 'replace',
+            'pwg_token': client.pwg_token(),
+        })
+    except Exception as e:
+        return [image_id, 'ERROR', str(e)]
+
+    return [image_id, 'FIXED', '']
+
+
+def main(report=AUDIT_REPORT, dry_run=False, concurrency=8, rate=5.0, log_path=RESULT_LOG):
+    image_ids = flagged_ids(report)
+    if not image_ids:
+        print(f'Nothing to repair in {report}')
+        return
+
+    client = get_client()
+    state = open_state()
+    limiter = TokenBucket(rate)
+
+    counts = Counter()
+    fixed = []
+    with open(log_path, 'w', newline='', encoding='utf-8') as log_f, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        log = csv.writer(log_f, delimiter='\t')
+        log.writerow(['PiwigoID', 'Result', 'Detail'])
+
+        rows = pool.map(lambda image_id: repair(client, state, limiter, image_id, dry_run), image_ids)
+        for row in tqdm(rows, total=len(image_ids), desc='Repairing descriptions', unit='img'):
+            counts[row[1]] += 1
+            if row[1] == 'DRY_RUN':
+                tqdm.write(row[2] or f'{row[0]}: already up to date')
+                # the diff is for the screen, the log just says whether there was one
+                row = [row[0], row[1], 'changes' if row[2] else 'no changes']
+            elif row[1] != 'FIXED':
+                tqdm.write(f'{row[0]}: {row[1]} {row[2]}')
+            log.writerow(row)
+            log_f.flush()
+            if row[1] == 'FIXED':
+                fixed.append(row[0])
+
+    # so description_audit.py --incremental checks them again
+    state.forget_audits(fixed)
+
+    print(f'Wrote {log_path}')
+    print(', '.join(f'{result}: {count}' for result, count in sorted(counts.items())))
+    if counts['FIXED']:
+        print('Run description_audit.py again to confirm')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild and upload descriptions flagged by description_audit.py')
+    parser.add_argument('--report', default=AUDIT_REPORT, help='audit report to read the flagged IDs from')
+    parser.add_argument('--dry-run', action='store_true', help='show a diff for each image instead of changing it')
+    parser.add_argument('--concurrency', type=int, default=8, help='max parallel requests to Piwigo')
+    parser.add_argument('--rate', type=float, default=5.0, help='max requests per second, 0 for no limit')
+    parser.add_argument('--log', default=RESULT_LOG, help='per-ID result log')
+    args = parser.parse_args()
+
+    main(args.report, args.dry_run, args.concurrency, args.rate, args.log)
@@ -0,0 +1,34 @@
+# one pass over a download folder, yielding only Deposit Photos files
+# os.scandir hands back the directory entries with their type, so nothing gets stat'ed twice
+
+import os
+
+from pathlib import Path
+
+
+PREFIX = 'Depositphotos_'
+SUFFIX = '_XL.jpg'
+
+
+def deposit_id_from_name(file):
+    if not file.startswith(PREFIX) or not file.endswith(SUFFIX):
+        return None
+
+    return file.removeprefix(PREFIX).removesuffix(SUFFIX)
+
+
+def scan(directory, recursive=False):
+    # yields (path, deposit id) for every Depositphotos_*_XL.jpg, subfolders too when recursive
+    pending = [Path(directory)]
+    while pending:
+        folder = pending.pop()
+        with os.scandir(folder) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.is_dir():
+                    if recursive:
+                        pending.append(Path(entry.path))
+                    continue
+
+                deposit_id = deposit_id_from_name(entry.name)
+                if deposit_id is not None and entry.is_file():
+                    yield Path(entry.path), deposit_id
@@ -1,14 +1,24 @@
-# note that you can also set copyright in the batch manager in piwigo
-# that is much faster and more accurate, but this will pair with the main script
-# use this if you can't find the batch manager
+# sets the copyright on every uploaded image that doesn't have it yet
+# by default this posts the batch manager's copyright action for CHUNK ids at a time, a few chunks in parallel,
+# the same thing the batch manager does when you select the images and click it by hand
+# --browser is the old way: open each picture page, click "Modify information" and save
+# main.py --copyright sets it right after each upload, so this is only needed for older images
 
+import argparse
 import csv
+import html
 import os
+import re
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
 from dotenv import load_dotenv
 from pathlib import Path
-from playwright.sync_api import sync_playwright
+
+from piwigo_api import PIWIGO_ROOT, PiwigoClient, PiwigoError
+from state import COPYRIGHTED, COPYRIGHTED_HEADER, StateStore, open_state
 
 
 # user/pass for piwigo
@@ -16,64 +26,189 @@ load_dotenv()
 USERNAME = os.getenv('USERNAME')
 PASSWORD = os.getenv('PASSWORD')
 
+# value of the copyright dropdown (#copyrightID) to apply
+COPYRIGHT_ID = os.getenv('COPYRIGHT_ID', '8')
+
+# batch manager action added by the Copyrights plugin, the core web API has no copyright field
+COPYRIGHT_ACTION = 'copyrights'
+BATCH_MANAGER = PIWIGO_ROOT + 'admin.php?page=batch_manager&mode=global'
+
+# ids per batch manager request
+CHUNK = 100
+
+# the admin page shows what happened in these boxes, a 200 alone doesn't mean the action ran
+INFOS = re.compile(r'<div[^>]*class="[^"]*\binfos\b', re.I)
+ERRORS = re.compile(r'<div[^>]*class="[^"]*\berrors\b[^>]*>(.*?)</div>', re.I | re.S)
+
+
+class CopyrightLog:
+    # copyrighted.tsv and state.db updates, shared by threads
+    def __init__(self, state: StateStore, path=COPYRIGHTED):
+        self.state = state
+        self.lock = threading.Lock()
+
+        path = Path(path)
+        if not path.exists() or path.stat().st_size == 0:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f, delimiter='\t').writerow(COPYRIGHTED_HEADER)
+
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file, delimiter='\t')
+
+    def record(self, image_ids):
+        with self.lock:
+            self.writer.writerows([image_id] for image_id in image_ids)
+            self.file.flush()
+        self.state.mark_copyrighted(image_ids)
+
+    def close(self):
+        self.file.close()
 
-def main():
-    with (open('completed.tsv', 'r', newline='', encoding='utf-8') as completed_tsv,
-          open('copyrighted.tsv', 'r', newline='', encoding='utf-8') as copyright_tsv):
-        image_ids = set()
 
-        # add all completed ids to the set
-        completed_reader = csv.reader(completed_tsv, delimiter='\t')
-        next(completed_reader) # skip header
+_admin = None
+_admin_lock = threading.Lock()
+
+
+def admin_client() -> PiwigoClient:
+    # the batch manager is an admin page, so this logs in with USERNAME/PASSWORD instead of the API key
+    global _admin
+
+    with _admin_lock:
+        if _admin is None:
+            if not USERNAME or not PASSWORD:
+                raise RuntimeError('USERNAME and PASSWORD are needed to set the copyright')
+            client = PiwigoClient(None)
+            client.ensure_login(USERNAME, PASSWORD)
+            _admin = client
+        return _admin
+
 
-        for row in completed_reader:
-            image_ids.add(row[7]) # piwigo id column
+def set_copyright(client: PiwigoClient, image_ids, copyright_id=COPYRIGHT_ID):
+    data = [
+        ('submit', '1'),
+        ('selectAction', COPYRIGHT_ACTION),
+        ('copyrightID', copyright_id),
+        ('pwg_token', client.pwg_token()),
+    ] + [('selection[]', str(image_id)) for image_id in image_ids]
 
-        # remove all already copyrighted ids from the set
-        copyrighted_reader = csv.reader(copyright_tsv, delimiter='\t')
-        next(copyrighted_reader) # skip header
+    r = client.send(BATCH_MANAGER, data, what='Batch manager copyright')
+    if r.status_code != 200:
+        raise PiwigoError(f'HTTP {r.status_code} from the batch manager')
+    if 'identification.php' in r.url:
+        raise PiwigoError(f'{USERNAME} is not allowed to use the batch manager')
 
-        # skip if already set
-        for row in copyrighted_reader:
-            if not row:
-                continue
-            image_ids.discard(row[0].strip())
+    errors = ERRORS.search(r.text)
+    if errors:
+        message = ' '.join(html.unescape(re.sub(r'<[^>]+>', ' ', errors.group(1))).split())
+        raise PiwigoError(f'Batch manager error: {message or "no message"}')
+    if not INFOS.search(r.text):
+        # expired token, missing plugin action... the page comes back without a confirmation
+        text = ' '.join(html.unescape(re.sub(r'<[^>]+>', ' ', r.text)).split())
+        raise PiwigoError(f'Batch manager did not confirm the change: {text[:200] or "empty page"}')
 
-    if not image_ids:
-        print('Already completed all ids.')
-        return
 
-    path = Path('copyrighted.tsv')
-    if not path.exists() or path.stat().st_size == 0:
-        with open(path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f, delimiter='\t')
-            writer.writerow('PiwigoID')
+def set_with_api(image_ids, log: CopyrightLog, workers=4, chunk=CHUNK):
+    client = admin_client()
+    chunks = [image_ids[i:i + chunk] for i in range(0, len(image_ids), chunk)]
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool, \
+            tqdm(total=len(image_ids), desc='Updating Copyright', unit='img') as bar:
+        futures = {pool.submit(set_copyright, client, ids): ids for ids in chunks}
+        for future in as_completed(futures):
+            ids = futures[future]
+            try:
+                future.result()
+            except PiwigoError as e:
+                # left out of copyrighted.tsv, the next run tries them again
+                bar.write(f'Could not set the copyright on {ids[0]}..{ids[-1]}: {e}')
+                failed += len(ids)
+            else:
+                log.record(ids)
+            bar.update(len(ids))
+
+    if failed:
+        print(f'{failed} images still need the copyright, run again to retry them')
 
-    with open('copyrighted.tsv', 'a') as copyrighted_tsv:
-        copyrighted = csv.writer(copyrighted_tsv, delimiter='\t')
 
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
+def browser_login(page):
+    # the saved session usually still works, the form is only filled in once it has expired
+    page.goto(PIWIGO_ROOT + 'admin.php')
+    if 'identification.php' not in page.url:
+        return False
+
+    page.get_by_label('username').fill(USERNAME)
+    page.get_by_label('password').fill(PASSWORD)
+    with page.expect_navigation():
+        page.get_by_role('button', name='Sign in').click()
+    return True
+
+
+def set_one(page, image_id):
+    url = PIWIGO_ROOT + 'picture?/' + image_id + '/category/3-images'
+    page.goto(url)
+    page.get_by_role('link', name='Modify information').click()
+    page.locator("#copyrightID").select_option(value=COPYRIGHT_ID)
+    page.get_by_role('button', name='Save Settings').click()
 
-            page.goto('https://mines.piwigo.com/identification.php')
 
-            page.get_by_label('username').fill(USERNAME)
-            page.get_by_label('password').fill(PASSWORD)
-            with page.expect_navigation():
-                page.get_by_role('button', name='Sign in').click()
+def set_with_browser(image_ids, log: CopyrightLog, headless=None):
+    from playwright.sync_api import sync_playwright
 
-            sorted_ids = sorted(image_ids, key=int)
+    from browser import BrowserSupervisor, TrafficStats, block_requests, open_context, save_storage_state
+
+    traffic = TrafficStats()
 
-            for image_id in tqdm(sorted_ids, desc='Updating Copyright', unit='img'):
-                url = 'https://mines.piwigo.com/picture?/' + image_id + '/category/3-images'
-                page.goto(url)
-                page.get_by_role('link', name='Modify information').click()
-                page.locator("#copyrightID").select_option(value="8")
-                page.get_by_role('button', name='Save Settings').click()
+    def new_context(browser):
+        context = open_context(browser)
+        block_requests(context, stats=traffic)
+        return context
+
+    with sync_playwright() as p:
+        # every new page (after a recycle or crash too) checks the login first
+        browser = BrowserSupervisor(p, headless, new_context, on_page=browser_login, log=tqdm.write)
+        save_storage_state(browser.context)
+
+        for image_id in tqdm(image_ids, desc='Updating Copyright', unit='img'):
+            try:
+                browser.run(lambda page: set_one(page, image_id))
+            finally:
+                browser.item_done()
+
+            log.record([image_id])
+
+        browser.close()
+        print(traffic.report())
+        print(browser.memory.report())
+
+
+def main(browser=False, workers=4, chunk=CHUNK, headless=True):
+    state = open_state()
+
+    # completed ids that haven't been copyrighted yet
+    image_ids = sorted(state.uncopyrighted_ids(), key=int)
+
+    if not image_ids:
+        print('Already completed all ids.')
+        return
 
-                copyrighted.writerow([image_id])
+    log = CopyrightLog(state)
+    try:
+        if browser:
+            set_with_browser(image_ids, log, headless)
+        else:
+            set_with_api(image_ids, log, workers, chunk)
+    finally:
+        log.close()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Set the copyright on uploaded images')
+    parser.add_argument('--browser', action='store_true',
+                        help='click through each picture page instead of using the batch manager')
+    parser.add_argument('--headed', action='store_true', help='show the browser window with --browser')
+    parser.add_argument('--workers', type=int, default=4, help='batch manager requests in parallel')
+    parser.add_argument('--chunk', type=int, default=CHUNK, help='images per batch manager request')
+    args = parser.parse_args()
+
+    main(args.browser, args.workers, args.chunk, headless=not args.headed)
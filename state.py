@@ -0,0 +1,613 @@
+# local state database shared by all the tools
+# keyed by DepositID with an index on PiwigoID, so resume checks and lookups don't rescan the TSV files
+# python state.py import|export moves data between the database and completed/failed/copyrighted.tsv
+# python state.py merge folds the per-worker log shards of a sharded main.py run into completed.tsv
+
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from pathlib import Path
+
+
+load_dotenv()
+
+DB_PATH = os.getenv('STATE_DB', 'state.db')
+
+# WAL needs shared memory between the processes, which a database on a network share can't give,
+# so sharded runs across several hosts set STATE_JOURNAL=DELETE
+JOURNAL_MODE = os.getenv('STATE_JOURNAL', 'WAL')
+
+COMPLETED = 'completed.tsv'
+FAILED = 'failed.tsv'
+COPYRIGHTED = 'copyrighted.tsv'
+
+COMPLETED_HEADER = ['LocalPath', 'DepositID', 'SourceURL', 'Title', 'Author', 'AltText', 'Keywords', 'PiwigoID']
+FAILED_HEADER = ['LocalPath', 'DepositID', 'Stage', 'Error']
+COPYRIGHTED_HEADER = ['PiwigoID']
+
+# pipeline stages in the order main.py runs them
+STAGES = ('alt_text', 'deposit', 'upload')
+
+# failed.tsv stage labels -> stage names
+STAGE_LABELS = {
+    'generating alt text': 'alt_text',
+    'shrinking image': 'alt_text',
+    'searching deposit photos': 'deposit',
+    'gathering title': 'deposit',
+    'gathering author': 'deposit',
+    'gathering keywords': 'deposit',
+    'piwigo addsimple': 'upload',
+    'piwigo chunked upload': 'upload',
+    'piwigo tags': 'upload',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    deposit_id TEXT PRIMARY KEY,
+    local_path TEXT,
+    source_url TEXT,
+    title TEXT,
+    author TEXT,
+    alt_text TEXT,
+    keywords TEXT,
+    piwigo_id TEXT,
+    run_id TEXT,
+    completed_seq INTEGER,
+    copyrighted INTEGER NOT NULL DEFAULT 0,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    md5 TEXT,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS images_piwigo_id ON images (piwigo_id);
+CREATE INDEX IF NOT EXISTS images_completed_seq ON images (completed_seq);
+CREATE INDEX IF NOT EXISTS images_run_id ON images (run_id);
+
+CREATE TABLE IF NOT EXISTS stages (
+    deposit_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    label TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (deposit_id, stage)
+);
+CREATE INDEX IF NOT EXISTS stages_status ON stages (status);
+
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    md5 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS file_hashes_md5 ON file_hashes (md5);
+
+CREATE TABLE IF NOT EXISTS alt_text_cache (
+    md5 TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    alt_text TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (md5, backend)
+);
+
+-- last description_audit.py result per image, fingerprint is NULL when the check errored
+CREATE TABLE IF NOT EXISTS audits (
+    piwigo_id TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    title TEXT,
+    has_alt_text TEXT,
+    status TEXT NOT NULL,
+    audited_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    original_sum TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (original_sum, position)
+);
+
+-- every Piwigo ID batch_delete.py removed, also the ones main.py never uploaded (from files, albums or tags)
+CREATE TABLE IF NOT EXISTS deleted_images (
+    piwigo_id TEXT PRIMARY KEY,
+    deleted_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS leases (
+    deposit_id TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_worker ON leases (worker);
+'''
+
+# columns added after the first release, for databases created before them
+MIGRATIONS = {
+    'images': {'md5': 'TEXT', 'duplicate_of': 'TEXT'},
+}
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS images_md5 ON images (md5);
+'''
+
+
+def stage_from_label(label):
+    return STAGE_LABELS.get(label.strip().lower(), label.strip().lower())
+
+
+class StateStore:
+    def __init__(self, path=DB_PATH):
+        self.path = str(path)
+        self._local = threading.local()
+
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            for table, columns in MIGRATIONS.items():
+                existing = {row['name'] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+                for column, kind in columns.items():
+                    if column not in existing:
+                        self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
+            self.conn.executescript(INDEXES)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, so each thread gets its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL lets readers run alongside the writer, busy_timeout queues concurrent writers
+            conn.execute(f'PRAGMA journal_mode={JOURNAL_MODE}')
+            conn.execute('PRAGMA busy_timeout=30000')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # lookups
+
+    def get(self, deposit_id) -> dict | None:
+        row = self.conn.execute('SELECT * FROM images WHERE deposit_id = ?', (deposit_id,)).fetchone()
+        return dict(row) if row else None
+
+    def by_piwigo_id(self, piwigo_id) -> dict | None:
+        row = self.conn.execute(
+            'SELECT * FROM images WHERE piwigo_id = ? ORDER BY completed_seq LIMIT 1', (str(piwigo_id),)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def is_completed(self, deposit_id) -> bool:
+        # uploaded, or skipped as a copy of something already on Piwigo
+        row = self.conn.execute(
+            'SELECT 1 FROM images WHERE deposit_id = ? AND (completed_seq IS NOT NULL OR duplicate_of IS NOT NULL)',
+            (deposit_id,),
+        ).fetchone()
+        return row is not None
+
+    def completed_ids(self) -> set[str]:
+        rows = self.conn.execute(
+            'SELECT deposit_id FROM images WHERE completed_seq IS NOT NULL OR duplicate_of IS NOT NULL'
+        )
+        return {row[0] for row in rows}
+
+    def piwigo_id_for_md5(self, md5) -> str | None:
+        row = self.conn.execute(
+            "SELECT piwigo_id FROM images WHERE md5 = ? AND piwigo_id IS NOT NULL AND piwigo_id != '' AND deleted = 0",
+            (md5,),
+        ).fetchone()
+        return row[0] if row else None
+
+    def piwigo_ids(self, include_deleted=False) -> list[str]:
+        # completed.tsv order, each PiwigoID once
+        rows = self.conn.execute(f'''
+            SELECT piwigo_id FROM images
+            WHERE piwigo_id IS NOT NULL AND piwigo_id != '' {'' if include_deleted else 'AND deleted = 0'}
+            GROUP BY piwigo_id ORDER BY MIN(completed_seq)
+        ''')
+        return [row[0] for row in rows]
+
+    def stage_status(self, deposit_id) -> dict[str, str]:
+        rows = self.conn.execute('SELECT stage, status FROM stages WHERE deposit_id = ?', (deposit_id,))
+        return {row['stage']: row['status'] for row in rows}
+
+    def failures(self) -> list[dict]:
+        # the latest failure of each image, labels outside STAGE_LABELS leave stage rows of their own behind
+        rows = self.conn.execute('''
+            SELECT local_path, deposit_id, label, error FROM (
+                SELECT images.local_path, stages.deposit_id, stages.label, stages.error, stages.updated_at,
+                       ROW_NUMBER() OVER (PARTITION BY stages.deposit_id ORDER BY stages.updated_at DESC) AS n
+                FROM stages JOIN images USING (deposit_id)
+                WHERE stages.status = 'failed' AND images.completed_seq IS NULL AND images.duplicate_of IS NULL
+            )
+            WHERE n = 1
+            ORDER BY updated_at
+        ''')
+        return [dict(row) for row in rows]
+
+    def uncopyrighted_ids(self) -> list[str]:
+        rows = self.conn.execute('''
+            SELECT DISTINCT piwigo_id FROM images
+            WHERE piwigo_id IS NOT NULL AND piwigo_id != '' AND copyrighted = 0 AND deleted = 0
+        ''')
+        return [row[0] for row in rows]
+
+    def run_piwigo_ids(self, run_id) -> list[str]:
+        rows = self.conn.execute('''
+            SELECT piwigo_id FROM images
+            WHERE run_id = ? AND piwigo_id IS NOT NULL AND piwigo_id != '' AND deleted = 0
+            GROUP BY piwigo_id ORDER BY MIN(completed_seq)
+        ''', (run_id,))
+        return [row[0] for row in rows]
+
+    def deleted_ids(self) -> set[str]:
+        # images.deleted covers databases from before deleted_images
+        rows = self.conn.execute('''
+            SELECT piwigo_id FROM deleted_images
+            UNION SELECT piwigo_id FROM images WHERE deleted = 1 AND piwigo_id IS NOT NULL
+        ''')
+        return {row[0] for row in rows}
+
+    # leases, so several main.py processes never work on the same image
+
+    def claim(self, deposit_id, worker, ttl) -> bool:
+        # free, expired or already ours, and not finished by anyone in the meantime
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute('''
+                INSERT INTO leases (deposit_id, worker, expires)
+                SELECT ?, ?, ? WHERE NOT EXISTS (
+                    SELECT 1 FROM images
+                    WHERE deposit_id = ? AND (completed_seq IS NOT NULL OR duplicate_of IS NOT NULL)
+                )
+                ON CONFLICT (deposit_id) DO UPDATE SET worker = excluded.worker, expires = excluded.expires
+                WHERE leases.expires < ? OR leases.worker = excluded.worker
+            ''', (deposit_id, worker, now + ttl, deposit_id, now))
+        return cursor.rowcount > 0
+
+    def holds_lease(self, deposit_id, worker) -> bool:
+        row = self.conn.execute(
+            'SELECT 1 FROM leases WHERE deposit_id = ? AND worker = ? AND expires >= ?', (deposit_id, worker, time.time())
+        ).fetchone()
+        return row is not None
+
+    def other_leases(self, worker) -> dict[str, float]:
+        # deposit_id -> expires for images other workers hold and nobody finished yet
+        rows = self.conn.execute('''
+            SELECT deposit_id, expires FROM leases
+            WHERE worker != ? AND NOT EXISTS (
+                SELECT 1 FROM images
+                WHERE images.deposit_id = leases.deposit_id
+                  AND (completed_seq IS NOT NULL OR duplicate_of IS NOT NULL)
+            )
+        ''', (worker,))
+        return {row['deposit_id']: row['expires'] for row in rows}
+
+    def renew_leases(self, worker, ttl):
+        with self.conn:
+            self.conn.execute('UPDATE leases SET expires = ? WHERE worker = ?', (time.time() + ttl, worker))
+
+    def release(self, deposit_id, worker):
+        with self.conn:
+            self.conn.execute('DELETE FROM leases WHERE deposit_id = ? AND worker = ?', (deposit_id, worker))
+
+    def release_all(self, worker):
+        with self.conn:
+            self.conn.execute('DELETE FROM leases WHERE worker = ?', (worker,))
+
+    # writes
+
+    def _upsert(self, deposit_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ', '.join(['deposit_id', *fields])
+        placeholders = ', '.join('?' * (len(fields) + 1))
+        updates = ', '.join(f'{k} = excluded.{k}' for k in fields)
+        self.conn.execute(
+            f'INSERT INTO images ({columns}) VALUES ({placeholders}) '
+            f'ON CONFLICT (deposit_id) DO UPDATE SET {updates}',
+            (deposit_id, *fields.values()),
+        )
+
+    def _set_stage(self, deposit_id, stage, status, label=None, error=None):
+        self.conn.execute('''
+            INSERT INTO stages (deposit_id, stage, status, label, error, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (deposit_id, stage) DO UPDATE SET
+                status = excluded.status, label = excluded.label, error = excluded.error, updated_at = excluded.updated_at
+        ''', (deposit_id, stage, status, label, error, time.time()))
+
+    def record_stage(self, deposit_id, stage, **fields):
+        # store a finished stage together with whatever it produced
+        with self.conn:
+            self._upsert(deposit_id, **fields)
+            self._set_stage(deposit_id, stage, 'done')
+
+    def record_failure(self, deposit_id, local_path, label, error):
+        with self.conn:
+            self._upsert(deposit_id, local_path=str(local_path))
+            self._set_stage(deposit_id, stage_from_label(label), 'failed', label, str(error))
+
+    def record_tag_failure(self, deposit_id, error):
+        # the image is on Piwigo without its tags, a stage outside STAGES so resuming doesn't upload it again
+        with self.conn:
+            self._set_stage(deposit_id, 'tags', 'failed', 'setting tags', str(error))
+
+    def mark_tagged(self, piwigo_ids):
+        with self.conn:
+            self.conn.executemany('''
+                UPDATE stages SET status = 'done', error = NULL, updated_at = ?
+                WHERE stage = 'tags' AND deposit_id IN (SELECT deposit_id FROM images WHERE piwigo_id = ?)
+            ''', [(time.time(), str(i)) for i in piwigo_ids])
+
+    def complete(self, deposit_id, local_path, source_url, title, author, alt_text, keywords, piwigo_id, run_id=None,
+                 md5=None):
+        with self.conn:
+            # take the write lock before reading MAX, or two workers can both get the same seq
+            self.conn.execute('BEGIN IMMEDIATE')
+            seq = self.conn.execute('SELECT COALESCE(MAX(completed_seq), 0) + 1 FROM images').fetchone()[0]
+            self._upsert(
+                deposit_id,
+                local_path=str(local_path),
+                source_url=source_url,
+                title=title,
+                author=author,
+                alt_text=alt_text,
+                keywords=keywords if isinstance(keywords, str) else ';'.join(keywords),
+                piwigo_id=str(piwigo_id),
+                run_id=run_id,
+                completed_seq=seq,
+                md5=md5,
+            )
+            for stage in STAGES:
+                self._set_stage(deposit_id, stage, 'done')
+
+    def record_duplicate(self, deposit_id, local_path, md5, piwigo_id):
+        # same content is already on Piwigo, link to it instead of uploading again
+        with self.conn:
+            self._upsert(deposit_id, local_path=str(local_path), md5=md5, duplicate_of=str(piwigo_id))
+            self._set_stage(deposit_id, 'upload', 'duplicate', error=f'Same file as Piwigo ID {piwigo_id}')
+
+    def mark_copyrighted(self, piwigo_ids):
+        with self.conn:
+            self.conn.executemany('UPDATE images SET copyrighted = 1 WHERE piwigo_id = ?', [(str(i),) for i in piwigo_ids])
+
+    def mark_deleted(self, piwigo_ids):
+        now = time.time()
+        rows = [(str(i), now) for i in piwigo_ids]
+        with self.conn:
+            # the first deletion time is kept when --force sends an id again
+            self.conn.executemany(
+                'INSERT INTO deleted_images (piwigo_id, deleted_at) VALUES (?, ?) ON CONFLICT (piwigo_id) DO NOTHING', rows,
+            )
+            self.conn.executemany(
+                'UPDATE images SET deleted = 1, updated_at = ? WHERE piwigo_id = ?', [(now, i) for i, _ in rows],
+            )
+
+    # file hash cache
+
+    def cached_hash(self, path, size, mtime_ns) -> str | None:
+        row = self.conn.execute(
+            'SELECT md5 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?', (str(path), size, mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def store_hash(self, path, size, mtime_ns, md5):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)', (str(path), size, mtime_ns, md5)
+            )
+
+    # alt text cache
+
+    def cached_alt_text(self, md5, backend) -> str | None:
+        row = self.conn.execute(
+            'SELECT alt_text FROM alt_text_cache WHERE md5 = ? AND backend = ?', (md5, backend)
+        ).fetchone()
+        return row[0] if row else None
+
+    def store_alt_text(self, md5, backend, alt_text):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO alt_text_cache VALUES (?, ?, ?, ?)', (md5, backend, alt_text, time.time())
+            )
+
+    # chunked uploads
+
+    def acked_chunks(self, original_sum) -> set[int]:
+        rows = self.conn.execute('SELECT position FROM upload_chunks WHERE original_sum = ?', (original_sum,))
+        return {row[0] for row in rows}
+
+    def ack_chunk(self, original_sum, position):
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO upload_chunks VALUES (?, ?)', (original_sum, position))
+
+    def clear_chunks(self, original_sum):
+        with self.conn:
+            self.conn.execute('DELETE FROM upload_chunks WHERE original_sum = ?', (original_sum,))
+
+    # description audits
+
+    def audit_results(self) -> dict[str, dict]:
+        rows = self.conn.execute('SELECT * FROM audits')
+        return {row['piwigo_id']: dict(row) for row in rows}
+
+    def store_audits(self, results):
+        # results are (piwigo_id, fingerprint, title, has_alt_text, status)
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO audits VALUES (?, ?, ?, ?, ?, ?)', [(*r, now) for r in results]
+            )
+
+    def forget_audits(self, piwigo_ids):
+        # changed on purpose, the next incremental audit checks them again
+        with self.conn:
+            self.conn.executemany('DELETE FROM audits WHERE piwigo_id = ?', [(str(i),) for i in piwigo_ids])
+
+    # TSV import/export
+
+    def import_tsvs(self, completed=COMPLETED, failed=FAILED, copyrighted=COPYRIGHTED):
+        counts = {'completed': 0, 'failed': 0, 'copyrighted': 0}
+
+        with self.conn:
+            if Path(completed).exists():
+                seq = self.conn.execute('SELECT COALESCE(MAX(completed_seq), 0) FROM images').fetchone()[0]
+                for row in read_tsv(completed):
+                    if len(row) < 8 or not row[1]:
+                        continue
+                    existing = self.conn.execute(
+                        'SELECT completed_seq FROM images WHERE deposit_id = ?', (row[1],)
+                    ).fetchone()
+                    if existing is None or existing[0] is None:
+                        seq += 1
+                        row_seq = seq
+                    else:
+                        row_seq = existing[0]
+                    self._upsert(
+                        row[1],
+                        local_path=row[0],
+                        source_url=row[2],
+                        title=row[3],
+                        author=row[4],
+                        alt_text=row[5],
+                        keywords=row[6],
+                        piwigo_id=row[7].strip(),
+                        completed_seq=row_seq,
+                    )
+                    for stage in STAGES:
+                        self._set_stage(row[1], stage, 'done')
+                    counts['completed'] += 1
+
+            if Path(failed).exists():
+                for row in read_tsv(failed):
+                    if len(row) < 4 or not row[1]:
+                        continue
+                    self._upsert(row[1], local_path=row[0])
+                    self._set_stage(row[1], stage_from_label(row[2]), 'failed', row[2], row[3])
+                    counts['failed'] += 1
+
+            if Path(copyrighted).exists():
+                for row in read_tsv(copyrighted):
+                    if row and row[0].strip():
+                        self.conn.execute('UPDATE images SET copyrighted = 1 WHERE piwigo_id = ?', (row[0].strip(),))
+                        counts['copyrighted'] += 1
+
+        return counts
+
+    def export_tsvs(self, completed=COMPLETED, failed=FAILED, copyrighted=COPYRIGHTED):
+        rows = self.conn.execute('''
+            SELECT local_path, deposit_id, source_url, title, author, alt_text, keywords, piwigo_id
+            FROM images WHERE completed_seq IS NOT NULL ORDER BY completed_seq
+        ''')
+        write_tsv(completed, COMPLETED_HEADER, rows)
+
+        self.export_failed(failed)
+
+        rows = self.conn.execute('''
+            SELECT piwigo_id FROM images WHERE copyrighted = 1 AND piwigo_id IS NOT NULL
+            GROUP BY piwigo_id ORDER BY MIN(completed_seq)
+        ''')
+        write_tsv(copyrighted, COPYRIGHTED_HEADER, rows)
+
+    def export_failed(self, failed=FAILED):
+        # failures that are still unresolved, replaces the old truncate-on-every-run failed.tsv
+        rows = [[f['local_path'], f['deposit_id'], f['label'], f['error']] for f in self.failures()]
+        write_tsv(failed, FAILED_HEADER, rows)
+
+
+def shard_path(path, shard) -> Path:
+    # completed.tsv -> completed.<shard>.tsv
+    path = Path(path)
+    return path.with_name(f'{path.stem}.{shard}{path.suffix}')
+
+
+def merge_shards(state: StateStore, completed=COMPLETED, failed=FAILED, copyrighted=COPYRIGHTED) -> int:
+    # appends the shard rows completed.tsv doesn't have yet, in the order the images finished
+    path = Path(completed)
+    shards = sorted(p for p in path.parent.glob(f'{path.stem}.*{path.suffix}') if p != path)
+
+    rows = list(read_tsv(path)) if path.exists() else []
+    seen = {row[1] for row in rows if len(row) > 1}
+    new = {}
+    for shard in shards:
+        for row in read_tsv(shard):
+            if len(row) > 1 and row[1] not in seen:
+                new[row[1]] = row
+
+    def order(row):
+        image = state.get(row[1])
+        seq = image['completed_seq'] if image else None
+        return (seq is None, seq or 0)
+
+    write_tsv(path, COMPLETED_HEADER, rows + sorted(new.values(), key=order))
+
+    # failures and copyrights are rebuilt from the database, their shards only mattered during the run
+    state.export_failed(failed)
+    rows = state.conn.execute('''
+        SELECT piwigo_id FROM images WHERE copyrighted = 1 AND piwigo_id IS NOT NULL
+        GROUP BY piwigo_id ORDER BY MIN(completed_seq)
+    ''')
+    write_tsv(copyrighted, COPYRIGHTED_HEADER, rows)
+
+    for log in (failed, copyrighted):
+        log = Path(log)
+        shards += [p for p in log.parent.glob(f'{log.stem}.*{log.suffix}') if p != log]
+    for shard in shards:
+        shard.unlink()
+    return len(new)
+
+
+def read_tsv(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f, delimiter='\t')
+        next(reader, None)  # header
+        for row in reader:
+            if row:
+                yield row
+
+
+def write_tsv(path, header, rows):
+    # write next to the target and swap, a crash never leaves a half written file
+    tmp = Path(str(path) + '.tmp')
+    with open(tmp, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(header)
+        writer.writerows(rows)
+    tmp.replace(path)
+
+
+def open_state(path=DB_PATH) -> StateStore:
+    # a brand new database starts from whatever the TSV files already record
+    new = not Path(path).exists()
+    state = StateStore(path)
+    if new:
+        state.import_tsvs()
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move data between state.db and the TSV files')
+    parser.add_argument('action', choices=['import', 'export', 'merge'])
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--force', action='store_true', help='merge even while images are still leased by workers')
+    args = parser.parse_args()
+
+    state = StateStore(args.db)
+    if args.action == 'import':
+        counts = state.import_tsvs()
+        print(f"Imported {counts['completed']} completed, {counts['failed']} failed, {counts['copyrighted']} copyrighted rows")
+    elif args.action == 'merge':
+        leased = state.conn.execute('SELECT COUNT(*) FROM leases WHERE expires >= ?', (time.time(),)).fetchone()[0]
+        if leased and not args.force:
+            # running workers still append to their shards, merging now would lose those rows
+            print(f'{leased} images are still leased, wait for the workers to finish (or use --force)')
+            raise SystemExit(1)
+        added = merge_shards(state)
+        print(f'Added {added} rows to {COMPLETED}, rewrote {FAILED} and {COPYRIGHTED}')
+    else:
+        state.export_tsvs()
+        print(f'Wrote {COMPLETED}, {FAILED} and {COPYRIGHTED}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# local copy of Piwigo's tag names and ids, so uploads and fixes set tags by id
+# instead of sending names for the server to look up (and maybe create) on every request
+# the list is read once from pwg.tags.getAdminList, tags that don't exist yet are created together before they're used
+# names are matched the way deposit_scrape.clean_keywords writes keywords, stripped and lowercased
+# python tags.py [--run RUN_ID] [--failed] puts the keywords saved in state.db back on images that are already uploaded
+
+import argparse
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from piwigo_api import PiwigoClient, PiwigoError, get_client
+from state import open_state
+
+
+def normalize(name) -> str:
+    return str(name).strip().lower()
+
+
+def split_keywords(keywords) -> list[str]:
+    # state.db keeps them ; separated
+    if isinstance(keywords, str):
+        keywords = keywords.split(';')
+    return [k for k in keywords if k.strip()] if keywords else []
+
+
+class TagRegistry:
+    # shared by every thread, creating tags is rare so it happens under the lock
+    def __init__(self, client: PiwigoClient, workers=4):
+        self.client = client
+        self.workers = workers
+        self.lock = threading.Lock()
+        self._ids = None
+
+    def _fetch(self) -> dict[str, str]:
+        tags = (self.client.post('pwg.tags.getAdminList') or {}).get('tags', [])
+        ids = {}
+        for tag in tags:
+            # the oldest tag wins if Piwigo has two that only differ in case
+            ids.setdefault(normalize(tag['name']), str(tag['id']))
+        return ids
+
+    def load(self):
+        # requests run outside the lock, the first list to arrive is kept
+        if self._ids is None:
+            ids = self._fetch()
+            with self.lock:
+                if self._ids is None:
+                    self._ids = ids
+        return self
+
+    def _add(self, name):
+        result = self.client.post('pwg.tags.add', {'name': name, 'pwg_token': self.client.pwg_token()})
+        return name, str(result['id'])
+
+    def ensure(self, names):
+        # creates every missing tag in one go, a few requests in parallel
+        # only the lookups hold the lock, so uploaders with known tags never wait behind the requests
+        keys = {normalize(n) for n in names} - {''}
+        self.load()
+        with self.lock:
+            missing = sorted(keys - self._ids.keys())
+        if not missing:
+            return
+
+        created = {}
+        failed = False
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(missing)))) as pool:
+            futures = [pool.submit(self._add, name) for name in missing]
+            for future in futures:
+                try:
+                    name, tag_id = future.result()
+                except PiwigoError:
+                    # usually someone else created it first, the fresh list below has it
+                    failed = True
+                else:
+                    created[name] = tag_id
+
+        fresh = self._fetch() if failed else {}
+        with self.lock:
+            self._ids.update(created)
+            for name, tag_id in fresh.items():
+                self._ids.setdefault(name, tag_id)
+            still_missing = [name for name in missing if name not in self._ids]
+        if still_missing:
+            raise PiwigoError(f'Could not create tags: {", ".join(still_missing)}')
+
+    def ids(self, names) -> list[str]:
+        # in keyword order, each tag once
+        self.ensure(names)
+        ids = []
+        with self.lock:
+            for name in names:
+                tag_id = self._ids.get(normalize(name))
+                if tag_id and tag_id not in ids:
+                    ids.append(tag_id)
+        return ids
+
+    def set_image_tags(self, image_id, names):
+        # replaces the image's tags with these, one setInfo request
+        # addSimple only takes tag names, so main.py pays this extra request per upload to set tags by id
+        self.client.post('pwg.images.setInfo', {
+            'image_id': image_id,
+            'tag_ids': ','.join(self.ids(names)),
+            'multiple_value_mode': 'replace',
+            'pwg_token': self.client.pwg_token(),
+        })
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(client: PiwigoClient = None) -> TagRegistry:
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = TagRegistry(client or get_client())
+        return _registry
+
+
+def main(run_id=None, workers=8, failed_only=False):
+    state = open_state()
+    where = 'AND run_id = ?' if run_id else ''
+    if failed_only:
+        # main.py uploaded these but couldn't set their tags
+        where += " AND deposit_id IN (SELECT deposit_id FROM stages WHERE stage = 'tags' AND status = 'failed')"
+    rows = state.conn.execute(f'''
+        SELECT piwigo_id, keywords FROM images
+        WHERE piwigo_id IS NOT NULL AND piwigo_id != '' AND deleted = 0 AND keywords IS NOT NULL {where}
+        GROUP BY piwigo_id ORDER BY MIN(completed_seq)
+    ''', (run_id,) if run_id else ()).fetchall()
+    images = [(row['piwigo_id'], split_keywords(row['keywords'])) for row in rows]
+    images = [(image_id, keywords) for image_id, keywords in images if keywords]
+    if not images:
+        print('No uploaded images with keywords in state.db')
+        return
+
+    registry = get_registry()
+    registry.ensure({k for _, keywords in images for k in keywords})
+
+    def retag(image):
+        image_id, keywords = image
+        try:
+            registry.set_image_tags(image_id, keywords)
+        except PiwigoError as e:
+            return f'{image_id}: {e}'
+        state.mark_tagged([image_id])
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for error in tqdm(pool.map(retag, images), total=len(images), desc='Setting tags', unit='img'):
+            if error:
+                tqdm.write(error)
+                failed += 1
+
+    print(f'Tagged {len(images) - failed} images' + (f', {failed} failed' if failed else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Set the keywords in state.db as tags on uploaded images')
+    parser.add_argument('--run', help='only images uploaded in this run (Run ID printed by main.py)')
+    parser.add_argument('--failed', action='store_true', help='only images main.py uploaded without their tags')
+    parser.add_argument('--workers', type=int, default=8, help='setInfo requests in parallel')
+    args = parser.parse_args()
+
+    main(args.run, args.workers, args.failed)
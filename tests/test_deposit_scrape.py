@@ -0,0 +1,51 @@
+# parse_deposit_html against saved Deposit Photos pages, so a change to their markup shows up here first
+# python -m unittest (or pytest) from the repo folder
+
+import unittest
+
+from pathlib import Path
+
+from deposit_scrape import NOT_FOUND_TITLE, parse_deposit_html
+
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+URL = 'https://depositphotos.com/photo/example.html'
+
+
+def parse(name, url=URL):
+    return parse_deposit_html((FIXTURES / name).read_text(encoding='utf-8'), url)
+
+
+class ParseDepositHtmlTest(unittest.TestCase):
+    def test_rendered_page(self):
+        info = parse('deposit_photo.html')
+
+        # the rendered page wins over the JSON-LD block on the same page
+        self.assertEqual(info.url, URL)
+        self.assertEqual(info.title, 'Happy family walking on the beach at sunset')
+        self.assertEqual(info.author, 'janedoe')
+        self.assertEqual(info.keywords, ['family', 'beach', 'sunset', 'parents & kids', 'walking'])
+        self.assertFalse(info.not_found)
+        self.assertTrue(info.complete)
+
+    def test_json_ld_only(self):
+        info = parse('deposit_photo_json_ld.html')
+
+        self.assertEqual(info.title, 'Mountain lake in the morning fog')
+        self.assertEqual(info.author, 'lakeshots')
+        self.assertEqual(info.keywords, ['lake', 'mountains', 'fog', 'morning', 'nature'])
+        self.assertTrue(info.complete)
+
+    def test_not_found(self):
+        info = parse('deposit_not_found.html', 'https://depositphotos.com/search/123')
+
+        self.assertEqual(info.title, NOT_FOUND_TITLE)
+        self.assertTrue(info.not_found)
+        # nothing else to wait for, main.py records it as not found instead of falling back to the browser
+        self.assertTrue(info.complete)
+        self.assertEqual(info.author, '')
+        self.assertEqual(info.keywords, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# LIMIT_<NAME> overrides from .env
+# python -m unittest (or pytest) from the repo folder
+
+import os
+import unittest
+
+from unittest import mock
+
+from ratelimit import HOSTS, HostLimits
+
+
+class HostLimitsFromEnvTest(unittest.TestCase):
+    def limits(self, name, value):
+        with mock.patch.dict(os.environ, {f'LIMIT_{name.upper()}': value}):
+            return HostLimits.from_env(name, HOSTS[name])
+
+    def test_fractional_overrides(self):
+        limits = self.limits('tailwind', 'max_rate=0.5, target_latency=7.5')
+
+        self.assertEqual(limits.max_rate, 0.5)
+        self.assertEqual(limits.target_latency, 7.5)
+        self.assertEqual(limits.concurrency, HOSTS['tailwind'].concurrency)
+
+    def test_whole_numbers(self):
+        limits = self.limits('deposit', 'concurrency=2,max_rate=1,failures=10')
+
+        self.assertEqual(limits.concurrency, 2)
+        self.assertIsInstance(limits.concurrency, int)
+        self.assertEqual(limits.max_rate, 1.0)
+        self.assertIsInstance(limits.max_rate, float)
+        self.assertEqual(limits.failures, 10)
+
+    def test_unknown_keys_are_ignored(self):
+        self.assertEqual(self.limits('piwigo', 'speed=3,max_rate='), HOSTS['piwigo'])
+
+    def test_bad_value(self):
+        with self.assertRaisesRegex(ValueError, 'LIMIT_PIWIGO: concurrency'):
+            self.limits('piwigo', 'concurrency=lots')
+
+
+if __name__ == '__main__':
+    unittest.main()